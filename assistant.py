@@ -0,0 +1,378 @@
+import os
+import time
+
+import metrics
+import model_router
+import prompts
+from history import HistoryManager, content_role, content_text
+from opener_cache import OpenerCache
+from providers import create_provider
+from retrieval import ContentIndex
+from deadlines import timed_call
+from hedging import hedged_call
+from scheduler import call_with_backoff
+from singleflight import SingleFlight
+from topic_graph import TopicGraph
+
+# Prepare check_understanding and conclude_topic replies in the background every N turns; 0 disables it
+PRECOMPUTE_EVERY = int(os.environ.get("SOCRATEACH_PRECOMPUTE_EVERY", "0"))
+SUMMARY_KINDS = ("check_understanding", "conclude_topic")
+
+# Load the model SDK at startup rather than on the first conversation
+PREWARM = os.environ.get("SOCRATEACH_PREWARM", "0") == "1"
+
+GENERATION_CONFIG = {
+    "temperature": 0.3,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+# Hands out configured models; pooled Gemini clients by default, or the local stub for load tests
+provider = create_provider()
+
+# Opening replies are fully determined by (topic, difficulty, mode), so they can be reused across students
+opener_cache = OpenerCache()
+
+# Students starting the same lesson at the same moment share one upstream call for the opener
+opener_flight = SingleFlight("opener")
+
+# Course notes from the knowledge/ directory; None when there are no notes to index
+content_index = ContentIndex.load()
+
+# Prerequisites, related topics and difficulty tags, for suggestions that need no model call
+topic_graph = TopicGraph.load()
+
+def prewarm():
+    provider.prewarm()
+
+def upstream(func, *args, **kwargs):
+    # Every model call is bounded by the request's deadline and retried with backoff on rate limits
+    return call_with_backoff(timed_call, func, *args, **kwargs)
+
+def side_upstream(call, func, *args, **kwargs):
+    # Side calls leave the chat untouched, so they are safe to hedge
+    return call_with_backoff(hedged_call, call, timed_call, func, *args, **kwargs)
+
+class SocraticTeachingAssistant:
+    def __init__(self):
+        self.knowledge_base = self.init_knowledge_base()
+        self.current_topic = None
+        self.chat_session = None
+        self.model = None  # The strong tier; the chat session is rebound to whichever tier a call is routed to
+        self.models = {}
+        self.side_models = {}
+        self.difficulty = "medium"  # Default difficulty
+        self.mode = "Socratic"  # Default mode
+        self.history = HistoryManager()
+        self.restored_history = None  # Chat history loaded from the session store, waiting for a model
+        self.turn_count = 0
+        self.precomputed = {}  # Summary kind -> (turn_count, text, computed_at)
+        self.freshness = None  # How up to date the last summary reply was
+
+    def configure_gemini(self, api_key):
+        instruction = self.system_instruction()
+        for tier, model_name in model_router.MODEL_TIERS.items():
+            self.models[tier] = provider.get_model(api_key, model_name, GENERATION_CONFIG, instruction)
+            # Side calls such as history summaries run without the teaching instructions
+            self.side_models[tier] = provider.get_model(api_key, model_name, GENERATION_CONFIG) if instruction else self.models[tier]
+        self.model = self.models[model_router.STRONG]
+        if self.chat_session is not None:
+            self.chat_session.model = self.model
+        elif self.restored_history is not None:
+            self.chat_session = self.model.start_chat(history=self.restored_history)
+            self.restored_history = None
+
+    def to_state(self):
+        history = self.chat_session.history if self.chat_session is not None else self.restored_history or []
+        return {
+            "current_topic": self.current_topic,
+            "difficulty": self.difficulty,
+            "mode": self.mode,
+            "history": [{"role": content_role(content), "parts": [content_text(content)]} for content in history],
+            "history_stats": self.history.to_state(),
+            "turn_count": self.turn_count,
+        }
+
+    def restore_state(self, state):
+        self.current_topic = state["current_topic"]
+        self.difficulty = state["difficulty"]
+        self.mode = state["mode"]
+        self.restored_history = state["history"]
+        self.history.restore_state(state["history_stats"])
+        self.turn_count = state["turn_count"]
+
+    def system_instruction(self):
+        if not self.current_topic:
+            return None
+        concepts = tuple(self.knowledge_base[self.current_topic])
+        return prompts.system_instruction(self.current_topic, concepts, self.difficulty, self.mode)
+
+    def init_knowledge_base(self):
+        if content_index is not None:
+            return content_index.topics
+        return topic_graph.knowledge_base()
+
+    def start_conversation(self, topic, api_key, difficulty):
+        if topic not in self.knowledge_base:
+            return prompts.unknown_topic_message(topic, topic_graph.topic_of(topic), list(self.knowledge_base))
+        if difficulty not in prompts.DIFFICULTIES:
+            return "Invalid difficulty level. Please choose 'easy', 'medium', or 'hard'."
+
+        self.current_topic = topic
+        self.difficulty = difficulty
+        self.configure_gemini(api_key)
+
+        opening = prompts.opening_message(topic, difficulty, self.mode)
+        tier = model_router.choose_tier("opener", difficulty)
+        model_name = model_router.MODEL_TIERS[tier]
+        cache_key = opener_cache.key(f"{provider.name}/{model_name}", GENERATION_CONFIG, [self.system_instruction(), opening])
+        opener = opener_cache.get(cache_key)
+        if opener is None:
+            opener = opener_flight.do(cache_key, self.generate_opener, tier, opening, cache_key)
+
+        # Seed the chat with the opening exchange; the opener itself is a stateless call
+        self.chat_session = self.model.start_chat(history=[
+            {"role": "user", "parts": [opening]},
+            {"role": "model", "parts": [opener]},
+        ])
+        return opener
+
+    def generate_opener(self, tier, opening, cache_key):
+        def attempt(tier):
+            with metrics.model_call("opener"), metrics.MODEL_TIER_LATENCY.time(tier=tier):
+                return side_upstream("opener", self.models[tier].generate_content, opening)
+
+        response = self.with_fallback("opener", tier, attempt)
+        metrics.record_usage("opener", response)
+        opener_cache.put(cache_key, response.text)
+        return response.text
+
+    def response_prompt(self, user_input):
+        references = []
+        if content_index is not None:
+            references = [chunk["text"] for chunk in content_index.search(user_input, self.current_topic)]
+        return prompts.turn_message(user_input, self.difficulty, self.mode, references)
+
+    def stored_turn(self, user_input):
+        # What the chat history keeps of the turn: the notes are only needed for this reply
+        return prompts.turn_message(user_input, self.difficulty, self.mode)
+
+    def store_turn(self, prompt, stored):
+        # Replaces the user turn just sent with its history version, if that differs
+        if stored is None or stored == prompt:
+            return
+        history = self.chat_session.history
+        self.chat_session.history = history[:-2] + [{"role": "user", "parts": [stored]}, history[-1]]
+
+    def process_response(self, user_input, api_key):
+        if not self.current_topic:
+            return "Please start a conversation first by choosing a topic."
+
+        self.configure_gemini(api_key)
+        tier = model_router.choose_tier("process_response", self.difficulty, user_input)
+        response = self.send_message(self.response_prompt(user_input), "process_response", tier, self.stored_turn(user_input))
+        return response.text
+
+    def stream_process_response(self, user_input, api_key):
+        if not self.current_topic:
+            yield "Please start a conversation first by choosing a topic."
+            return
+
+        self.configure_gemini(api_key)
+        tier = model_router.choose_tier("process_response", self.difficulty, user_input)
+        yield from self.stream_message(self.response_prompt(user_input), "process_response", tier, self.stored_turn(user_input))
+
+    def change_difficulty(self, new_difficulty, api_key):
+        if new_difficulty not in prompts.DIFFICULTIES:
+            return "Invalid difficulty level. Please choose 'easy', 'medium', or 'hard'."
+
+        self.difficulty = new_difficulty
+        self.configure_gemini(api_key)  # Swaps in the system instruction for the new difficulty
+        response = self.send_message(prompts.difficulty_change_message(self.difficulty, self.mode), "change_difficulty")
+        return response.text
+
+    def switch_mode(self, new_mode, api_key):
+        if new_mode not in prompts.MODES:
+            return "Invalid mode. Please choose 'Socratic' or 'Q&A'."
+
+        self.mode = new_mode
+        self.configure_gemini(api_key)  # Swaps in the system instruction for the new mode
+        response = self.send_message(prompts.mode_change_message(self.difficulty, self.mode), "switch_mode")
+        return response.text
+
+    def check_understanding_prompt(self):
+        return prompts.check_understanding_message(self.current_topic)
+
+    def check_understanding(self, api_key):
+        self.configure_gemini(api_key)
+        reply = self.use_precomputed("check_understanding")
+        if reply is None:
+            reply = self.send_message(self.check_understanding_prompt(), "check_understanding").text
+        return reply + self.related_topics_note()
+
+    def stream_check_understanding(self, api_key):
+        self.configure_gemini(api_key)
+        precomputed = self.use_precomputed("check_understanding")
+        if precomputed is not None:
+            yield precomputed
+        else:
+            yield from self.stream_message(self.check_understanding_prompt(), "check_understanding")
+        note = self.related_topics_note()
+        if note:
+            yield note
+
+    def conclude_topic_prompt(self):
+        return prompts.conclude_topic_message(self.current_topic)
+
+    def conclude_topic(self, api_key):
+        self.configure_gemini(api_key)
+        reply = self.use_precomputed("conclude_topic")
+        if reply is None:
+            reply = self.send_message(self.conclude_topic_prompt(), "conclude_topic").text
+        return reply + self.related_topics_note()
+
+    def stream_conclude_topic(self, api_key):
+        self.configure_gemini(api_key)
+        precomputed = self.use_precomputed("conclude_topic")
+        if precomputed is not None:
+            yield precomputed
+        else:
+            yield from self.stream_message(self.conclude_topic_prompt(), "conclude_topic")
+        note = self.related_topics_note()
+        if note:
+            yield note
+
+    def related_topics_note(self):
+        return prompts.related_topics_note(topic_graph.suggestions(self.current_topic))
+
+    def summary_prompt(self, kind):
+        return self.check_understanding_prompt() if kind == "check_understanding" else self.conclude_topic_prompt()
+
+    def use_precomputed(self, kind):
+        entry = self.precomputed.pop(kind, None)
+        if entry is None or entry[0] != self.turn_count:
+            self.freshness = {"precomputed": False, "computed_at_turn": self.turn_count, "age_seconds": 0.0}
+            return None
+        turn, text, computed_at = entry
+        # Record the exchange as if it had been sent, so the lesson continues from it
+        self.chat_session.history = list(self.chat_session.history) + [
+            {"role": "user", "parts": [self.summary_prompt(kind)]},
+            {"role": "model", "parts": [text]},
+        ]
+        self.turn_count += 1
+        self.freshness = {"precomputed": True, "computed_at_turn": turn, "age_seconds": round(time.time() - computed_at, 3)}
+        return text
+
+    def precompute_job(self):
+        # Called right after a turn. Returns a function that prepares the summary replies from a
+        # snapshot of the history through side calls, leaving the chat session itself untouched.
+        if PRECOMPUTE_EVERY <= 0 or self.chat_session is None or self.turn_count % PRECOMPUTE_EVERY:
+            return None
+        snapshot = list(self.chat_session.history)
+        turn = self.turn_count
+        tier = model_router.choose_tier("precompute", self.difficulty)
+        model = self.models[tier]
+        summary_prompts = {kind: self.summary_prompt(kind) for kind in SUMMARY_KINDS}
+
+        def job():
+            for kind, prompt in summary_prompts.items():
+                if self.turn_count != turn:
+                    return  # A newer turn already made this snapshot stale
+                try:
+                    with metrics.model_call("precompute"), metrics.MODEL_TIER_LATENCY.time(tier=tier):
+                        response = side_upstream("precompute", model.generate_content, snapshot + [{"role": "user", "parts": [prompt]}])
+                except Exception:
+                    return  # Best effort; the buttons fall back to a live call
+                metrics.record_usage("precompute", response)
+                self.precomputed[kind] = (turn, response.text, time.time())
+
+        return job
+
+    def summarize(self, prompt):
+        # Side call that doesn't touch the chat history
+        def attempt(tier):
+            with metrics.model_call("summary"), metrics.MODEL_TIER_LATENCY.time(tier=tier):
+                return side_upstream("summary", self.side_models[tier].generate_content, prompt)
+
+        response = self.with_fallback("summary", model_router.choose_tier("summary", self.difficulty), attempt)
+        metrics.record_usage("summary", response)
+        return response.text
+
+    def prepare_turn(self):
+        self.turn_count += 1
+        self.precomputed.clear()
+        self.history.maybe_compact(self.chat_session, self.summarize)
+        self.history.record_turn()
+        metrics.HISTORY_TOKENS_SAVED.inc(self.history.tokens_saved_per_turn)
+
+    def with_fallback(self, method, tier, attempt):
+        # Runs attempt(tier), retrying on the larger model if a smaller one fails in a way it might not
+        metrics.MODEL_ROUTED.inc(method=method, tier=tier)
+        while True:
+            try:
+                return attempt(tier)
+            except Exception as exc:
+                fallback = model_router.fallback(tier)
+                if fallback is None or not model_router.should_fall_back(exc):
+                    raise
+                metrics.MODEL_TIER_FALLBACKS.inc(tier=tier)
+                tier = fallback
+
+    def send_message(self, prompt, method, tier=None, stored=None):
+        tier = tier or model_router.choose_tier(method, self.difficulty)
+        self.prepare_turn()
+
+        def attempt(tier):
+            self.chat_session.model = self.models[tier]
+            with metrics.model_call("chat"), metrics.MODEL_TIER_LATENCY.time(tier=tier):
+                return upstream(self.chat_session.send_message, prompt)
+
+        response = self.with_fallback(method, tier, attempt)
+        self.store_turn(prompt, stored)
+        metrics.record_usage("chat", response)
+        return response
+
+    def stream_message(self, prompt, method, tier=None, stored=None):
+        tier = tier or model_router.choose_tier(method, self.difficulty)
+        self.prepare_turn()
+
+        def attempt(tier):
+            self.chat_session.model = self.models[tier]
+            # Rate limits and failures surface before the first chunk, so only the opening call is retried
+            return tier, upstream(self.chat_session.send_message, prompt, stream=True)
+
+        started = completed = False
+        try:
+            with metrics.model_call("chat_stream"):
+                start = time.perf_counter()
+                tier, response = self.with_fallback(method, tier, attempt)
+                started = True
+                for chunk in response:
+                    yield chunk.text
+                metrics.MODEL_TIER_LATENCY.observe(time.perf_counter() - start, tier=tier)
+            completed = True
+        finally:
+            # Drop the half-received turn so the chat history stays consistent. If the opening call
+            # failed there is no such turn, and rewinding would drop the previous exchange instead.
+            if started and not completed:
+                self.chat_session.rewind()
+        self.store_turn(prompt, stored)
+        metrics.record_usage("chat_stream", response)
+
+    def end_conversation(self):
+        if not self.current_topic:
+            return "No active conversation to end."
+
+        self.current_topic = None
+        self.chat_session = None
+        self.model = None
+        self.models = {}
+        self.side_models = {}
+        self.difficulty = "medium"  # Reset to default difficulty
+        self.mode = "Socratic"  # Reset to default mode
+        self.history = HistoryManager()
+        self.restored_history = None
+        self.turn_count = 0
+        self.precomputed = {}
+        return "Thank you for the discussion. Is there anything else you'd like to explore?"
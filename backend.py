@@ -1,162 +1,94 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import functools
+import json
+import os
+from contextlib import aclosing, asynccontextmanager
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-import google.generativeai as genai
-
-class SocraticTeachingAssistant:
-    def __init__(self):
-        self.knowledge_base = self.init_knowledge_base()
-        self.current_topic = None
-        self.chat_session = None
-        self.model = None
-        self.difficulty = "medium"  # Default difficulty
-        self.mode = "Socratic"  # Default mode
-
-    def configure_gemini(self, api_key):
-        genai.configure(api_key=api_key)
-        generation_config = {
-            "temperature": 0.3,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-        }
-        self.model = genai.GenerativeModel(
-            model_name="gemini-1.5-pro",
-            generation_config=generation_config,
-        )
-
-    def init_knowledge_base(self):
-        return {
-            "sorting": ["bubble sort", "quick sort", "merge sort"],
-            "searching": ["linear search", "binary search"],
-            "data structures": ["array", "linked list", "tree", "graph"],
-        }
-
-    def start_conversation(self, topic, api_key, difficulty):
-        self.configure_gemini(api_key)
-        if topic not in self.knowledge_base:
-            return f"I'm sorry, I don't have information about {topic}. Let's discuss sorting, searching, or data structures."
-
-        self.current_topic = topic
-        self.difficulty = difficulty
-        self.chat_session = self.model.start_chat(history=[])
-
-        system_prompt = f"""
-        You are a teaching assistant specializing in Data Structures and Algorithms, 
-        particularly in {topic}. Your goal is to help the student understand {topic}.
-        Focus on concepts like: {', '.join(self.knowledge_base[topic])}.
-        The current difficulty level is set to {difficulty}. Adjust your explanations accordingly.
-        For 'easy', use simpler terms and basic concepts. For 'medium', introduce more complex ideas.
-        For 'hard', challenge the student with advanced concepts and edge cases.
-        The current mode is {self.mode}. In Socratic mode, guide through questions. In Q&A mode, provide direct answers.
-        Start by asking what the student already knows about {topic}, keeping in mind the {difficulty} difficulty level.
-        """
-
-        response = self.chat_session.send_message(system_prompt)
-        return response.text
-
-    def process_response(self, user_input, api_key):
-        if not self.chat_session:
-            return "Please start a conversation first by choosing a topic."
-
-        self.configure_gemini(api_key)
-        if self.mode == "Socratic":
-            prompt = f"""
-            The student's response was: "{user_input}"
-            Analyze their understanding and formulate a Socratic question to deepen their knowledge 
-            of {self.current_topic}. Remember to guide them towards understanding rather than 
-            providing direct answers. If they seem confused, break down the concept further.
-            If they show understanding, challenge them with a more advanced aspect of {self.current_topic}.
-            Keep in mind that the current difficulty level is {self.difficulty}.
-            For 'easy', use simpler terms and focus on basic concepts.
-            For 'medium', introduce more complex ideas and terminology.
-            For 'hard', challenge the student with advanced concepts, edge cases, and deeper analysis.
-            """
-        else:  # Q&A mode
-            prompt = f"""
-            The student's question was: "{user_input}"
-            Provide a clear, concise, and direct answer about {self.current_topic}. 
-            If the question asks for code, include a relevant code snippet.
-            Do not use the Socratic method or ask the student to think about the process themselves.
-            If the question is not directly related to {self.current_topic}, provide a brief answer 
-            and gently redirect to the current topic.
-            Keep in mind that the current difficulty level is {self.difficulty}.
-            """
-
-        response = self.chat_session.send_message(prompt)
-        return response.text
-
-    def change_difficulty(self, new_difficulty, api_key):
-        if new_difficulty not in ["easy", "medium", "hard"]:
-            return "Invalid difficulty level. Please choose 'easy', 'medium', or 'hard'."
-
-        self.difficulty = new_difficulty
-        self.configure_gemini(api_key)
-        prompt = f"""
-        The difficulty level has been changed to {new_difficulty}. Adjust your teaching approach accordingly.
-        For 'easy', use simpler terms and focus on basic concepts.
-        For 'medium', introduce more complex ideas and terminology.
-        For 'hard', challenge the student with advanced concepts, edge cases, and deeper analysis.
-        Inform the student about the change and ask an appropriate question to continue the lesson at the new difficulty level.
-        """
-
-        response = self.chat_session.send_message(prompt)
-        return response.text
-
-    def switch_mode(self, new_mode, api_key):
-        self.mode = new_mode
-        self.configure_gemini(api_key)
-        prompt = f"""
-        The conversation mode has been switched to {new_mode} mode.
-        For Socratic mode, use questions to guide the student's learning about {self.current_topic}.
-        For Q&A mode, provide direct and concise answers about {self.current_topic}.
-        Respond with an appropriate message to acknowledge the mode change and set the tone for the new mode.
-        """
-        response = self.chat_session.send_message(prompt)
-        return response.text
-
-    def check_understanding(self, api_key):
-        self.configure_gemini(api_key)
-        prompt = f"""
-        Based on the conversation so far about {self.current_topic}, provide the following:
-        1. A brief summary (2-3 sentences) of what we've discussed and the main concepts covered.
-        2. An assessment of the student's current understanding, noting any areas of strength or confusion.
-        3. A question or set of options for the student to choose from, such as:
-        a) Would you like to dive deeper into any specific aspect of {self.current_topic}?
-        b) Are you ready to move on to a related topic? If so, I can suggest some options.
-        c) Do you feel you've grasped the main concepts and want to conclude this topic?
-        d) Are there any parts of {self.current_topic} you'd like me to explain differently?
-        
-        Present this information clearly and concisely, maintaining a supportive and encouraging tone.
-        """
-        response = self.chat_session.send_message(prompt)
-        return response.text
-
-    def conclude_topic(self, api_key):
-        self.configure_gemini(api_key)
-        prompt = f"""
-        Provide a concise summary of the key points discussed about {self.current_topic}.
-        Highlight the main concepts learned, any problem-solving strategies introduced, and suggestions for further study.
-        End with an encouraging message about applying this knowledge to real-world programming challenges.
-        """
-        response = self.chat_session.send_message(prompt)
-        return response.text
-
-    def end_conversation(self):
-        if not self.chat_session:
-            return "No active conversation to end."
-
-        self.current_topic = None
-        self.chat_session = None
-        self.model = None
-        self.difficulty = "medium"  # Reset to default difficulty
-        self.mode = "Socratic"  # Reset to default mode
-        return "Thank you for the discussion. Is there anything else you'd like to explore?"
-
-app = FastAPI()
-
-# Global instance of the assistant
-assistant = SocraticTeachingAssistant()
+from starlette.websockets import WebSocketState
+from typing import List, Literal, Optional
+import metrics
+import prompts
+from assistant import PREWARM, SUMMARY_KINDS, SocraticTeachingAssistant, opener_cache, prewarm, provider, topic_graph
+from deadlines import DeadlineExceeded
+from disconnect import CancelOnDisconnectMiddleware
+from history import estimate_tokens
+from jobs import FINISHED, JobQueue
+from model_executor import run_model_call, stream_model_call
+from scheduler import RateLimited, Scheduler
+from session_socket import CLOSE, REPLACED, WS_HEARTBEAT_SECONDS, WS_NUDGE_SECONDS, Outbox
+from sessions import SessionManager, SessionNotFound
+
+BATCH_CONCURRENCY = int(os.environ.get("SOCRATEACH_BATCH_CONCURRENCY", "8"))
+BATCH_MAX_ITEMS = int(os.environ.get("SOCRATEACH_BATCH_MAX_ITEMS", "200"))
+
+# Every upstream call waits here for its API key's quota and a fair share of the model workers
+scheduler = Scheduler()
+
+# Keeps references to fire-and-forget work so it isn't garbage collected mid-flight
+background_tasks = set()
+
+# Open /ws/session connections
+sockets = set()
+
+@asynccontextmanager
+async def lifespan(app):
+    if PREWARM:
+        # Warm up in the background so the server starts accepting requests right away
+        task = asyncio.ensure_future(run_model_call(prewarm))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    sweeper = asyncio.ensure_future(sessions.sweep())
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+
+app = FastAPI(lifespan=lifespan)
+if provider.name == "record":
+    # Saves the requests next to the model calls they cause, for benchmarks/profile_replay.py
+    from cassette import CASSETTE_HASH_ONLY, RequestRecorder
+
+    if not CASSETTE_HASH_ONLY:
+        app.add_middleware(RequestRecorder, cassette=provider.cassette)
+app.add_middleware(CancelOnDisconnectMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Each student gets their own assistant, looked up by the session id returned from /start_conversation
+sessions = SessionManager(SocraticTeachingAssistant)
+
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_active_sessions", "Conversations currently held in memory.", function=lambda: len(sessions)))
+metrics.REGISTRY.register(metrics.Counter(
+    "socrateach_opener_cache_hits_total", "Conversations started from a cached opening reply.",
+    function=lambda: opener_cache.hits))
+metrics.REGISTRY.register(metrics.Counter(
+    "socrateach_opener_cache_misses_total", "Conversation starts that had to call the model for the opening reply.",
+    function=lambda: opener_cache.misses))
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_scheduler_queue_depth", "Model calls waiting for quota or a free worker.", function=lambda: scheduler.depth))
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_scheduler_inflight", "Model calls admitted by the scheduler and still running.", function=lambda: scheduler.inflight))
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_websocket_connections", "Open /ws/session connections.", function=lambda: len(sockets)))
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_job_queue_depth", "Background jobs waiting for a worker.", function=lambda: jobs.depth))
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_jobs_running", "Background jobs being worked on.", function=lambda: jobs.running))
+metrics.REGISTRY.register(metrics.Gauge(
+    "socrateach_jobs_retained", "Background jobs held in memory, finished or not.", function=lambda: len(jobs.jobs)))
+
+@app.exception_handler(RateLimited)
+async def rate_limited(request, exc):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": exc.retry_after_header})
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request, exc):
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
+
+# Shared, read-only instance used for topic listings
+knowledge_base = SocraticTeachingAssistant().knowledge_base
 
 class TopicRequest(BaseModel):
     topic: str
@@ -164,67 +96,506 @@ class TopicRequest(BaseModel):
     difficulty: str = "medium"
 
 class MessageRequest(BaseModel):
+    session_id: str
     message: str
     api_key: str
 
 class DifficultyRequest(BaseModel):
+    session_id: str
     difficulty: str
     api_key: str
 
 class ApiKeyOnlyRequest(BaseModel):
+    session_id: str
     api_key: str
 
+class SessionRequest(BaseModel):
+    session_id: str
+
+class JobRequest(BaseModel):
+    session_id: str
+    api_key: str
+    priority: Literal["high", "normal", "low"] = "normal"
+
+class BatchItem(BaseModel):
+    session_id: str
+    message: str
+
+class BatchMessageRequest(BaseModel):
+    api_key: str
+    items: List[BatchItem]
+    concurrency: Optional[int] = None  # Capped at SOCRATEACH_BATCH_CONCURRENCY
+
+class Freshness(BaseModel):
+    precomputed: bool  # Served from a reply prepared in the background
+    computed_at_turn: int
+    age_seconds: float
+
 class ConversationResponse(BaseModel):
     response: str
+    session_id: Optional[str] = None
+    freshness: Optional[Freshness] = None
+
+def request_tokens(session, message=""):
+    # Rough prompt size for the scheduler's per-key token budget. Call it under session.lock: reading
+    # the SDK's chat history folds in the last reply, which must not race a turn on a worker thread.
+    assistant = session.assistant
+    history = assistant.chat_session.history if assistant.chat_session is not None else []
+    return assistant.history.history_tokens(history) + estimate_tokens(message)
+
+def schedule_precompute(session, api_key):
+    # Called under the session lock, right after a turn; the job itself works from a snapshot
+    job = session.assistant.precompute_job()
+    if job is None:
+        return
+    tokens = request_tokens(session) * len(SUMMARY_KINDS)
+
+    async def run():
+        try:
+            async with scheduler.slot(api_key, tokens):
+                await run_model_call(job)
+        except RateLimited:
+            pass  # Quota is better spent on students; the buttons fall back to a live call
+
+    task = asyncio.ensure_future(run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def get_session(session_id):
+    try:
+        return await sessions.get(session_id)
+    except SessionNotFound:
+        raise HTTPException(status_code=404, detail="Unknown or expired session. Please start a new conversation.")
+
+async def get_active_session(session_id, detail):
+    session = await get_session(session_id)
+    if not session.assistant.current_topic:
+        raise HTTPException(status_code=400, detail=detail)
+    return session
+
+def error_details(exc):
+    # How a failure is reported inside a response that has already started, e.g. a batch or a WebSocket
+    if isinstance(exc, HTTPException):
+        return {"status_code": exc.status_code, "detail": exc.detail}
+    if isinstance(exc, RateLimited):
+        return {"status_code": 429, "detail": str(exc), "retry_after": exc.retry_after}
+    if isinstance(exc, DeadlineExceeded):
+        return {"status_code": 504, "detail": str(exc)}
+    return {"status_code": 502, "detail": str(exc)}
+
+# Summaries requested through the /jobs endpoints run here, in the background
+jobs = JobQueue(error_details)
+
+def format_sse(data, event=None):
+    message = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{message}" if event else message
+
+def sse_response(session, api_key, message, method, *args, summary=False):
+    async def events():
+        async with session.lock:
+            try:
+                # aclosing: if the client goes away, the stream is stopped before the lock is released
+                async with scheduler.slot(api_key, request_tokens(session, message)), aclosing(stream_model_call(method, *args)) as chunks:
+                    async for chunk in chunks:
+                        yield format_sse({"text": chunk})
+                await sessions.save(session)
+                if not summary:
+                    schedule_precompute(session, api_key)
+            except RateLimited as exc:
+                yield format_sse({"detail": str(exc), "retry_after": exc.retry_after}, event="error")
+                return
+            except Exception as exc:
+                yield format_sse({"detail": str(exc)}, event="error")
+                return
+        done = {"session_id": session.session_id}
+        if summary:
+            done["freshness"] = session.assistant.freshness
+        yield format_sse(done, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def open_session(topic, api_key, difficulty, outbox=None):
+    # Returns the opener and the new session, or None for the session if the topic wasn't started.
+    # The session is only kept once its conversation has started; a failed or abandoned start removes it.
+    session = await sessions.create()
+    session.outbox = outbox
+    try:
+        async with session.lock:
+            async with scheduler.slot(api_key, estimate_tokens(topic)):
+                response = await run_model_call(session.assistant.start_conversation, topic, api_key, difficulty)
+            if session.assistant.current_topic:
+                await sessions.save(session)
+                return response, session
+    except BaseException:
+        await sessions.remove(session.session_id)
+        raise
+    await sessions.remove(session.session_id)
+    return response, None
 
 @app.post("/start_conversation", response_model=ConversationResponse)
 async def start_conversation(request: TopicRequest):
-    response = assistant.start_conversation(request.topic, request.api_key, request.difficulty)
-    return ConversationResponse(response=response)
+    response, session = await open_session(request.topic, request.api_key, request.difficulty)
+    return ConversationResponse(response=response, session_id=session.session_id if session else None)
+
+async def process_message(session_id, message, api_key):
+    session = await get_session(session_id)
+    async with session.lock:
+        if not session.assistant.current_topic:
+            raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
+        async with scheduler.slot(api_key, request_tokens(session, message)):
+            response = await run_model_call(session.assistant.process_response, message, api_key)
+        await sessions.save(session)
+        schedule_precompute(session, api_key)
+    return response
 
 @app.post("/process_response", response_model=ConversationResponse)
 async def process_response(request: MessageRequest):
-    if not assistant.current_topic:
-        raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
-    response = assistant.process_response(request.message, request.api_key)
-    return ConversationResponse(response=response)
+    response = await process_message(request.session_id, request.message, request.api_key)
+    return ConversationResponse(response=response, session_id=request.session_id)
+
+@app.post("/batch/process_response")
+async def batch_process_response(request: BatchMessageRequest):
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ITEMS} items.")
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_item(index, item):
+        result = {"index": index, "session_id": item.session_id}
+        async with semaphore:
+            try:
+                result["response"] = await process_message(item.session_id, item.message, request.api_key)
+            except Exception as exc:
+                result["error"] = error_details(exc)
+        return result
+
+    # One JSON object per line, in the order the items finish; a failed item never fails the batch
+    async def results():
+        tasks = [asyncio.ensure_future(run_item(index, item)) for index, item in enumerate(request.items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/process_response/stream")
+async def stream_process_response(request: MessageRequest):
+    session = await get_active_session(request.session_id, "No active conversation. Please start a conversation first.")
+    return sse_response(session, request.api_key, request.message,
+                        session.assistant.stream_process_response, request.message, request.api_key)
 
 @app.post("/change_difficulty", response_model=ConversationResponse)
 async def change_difficulty(request: DifficultyRequest):
-    if not assistant.current_topic:
-        raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
-    response = assistant.change_difficulty(request.difficulty, request.api_key)
-    return ConversationResponse(response=response)
+    session = await get_session(request.session_id)
+    async with session.lock:
+        if not session.assistant.current_topic:
+            raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
+        async with scheduler.slot(request.api_key, request_tokens(session)):
+            response = await run_model_call(session.assistant.change_difficulty, request.difficulty, request.api_key)
+        await sessions.save(session)
+    return ConversationResponse(response=response, session_id=session.session_id)
 
 @app.post("/switch_mode", response_model=ConversationResponse)
 async def switch_mode(request: MessageRequest):
-    if not assistant.current_topic:
-        raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
-    response = assistant.switch_mode(request.message, request.api_key)
-    return ConversationResponse(response=response)
+    session = await get_session(request.session_id)
+    async with session.lock:
+        if not session.assistant.current_topic:
+            raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
+        async with scheduler.slot(request.api_key, request_tokens(session)):
+            response = await run_model_call(session.assistant.switch_mode, request.message, request.api_key)
+        await sessions.save(session)
+    return ConversationResponse(response=response, session_id=session.session_id)
+
+async def run_summary(session, api_key, kind):
+    # check_understanding or conclude_topic; returns the reply and its freshness
+    async with session.lock:
+        if not session.assistant.current_topic:
+            raise HTTPException(status_code=400, detail="No active conversation.")
+        async with scheduler.slot(api_key, request_tokens(session)):
+            response = await run_model_call(getattr(session.assistant, kind), api_key)
+        await sessions.save(session)
+        return response, session.assistant.freshness
+
+async def summary_job(session_id, api_key, kind):
+    response, freshness = await run_summary(await get_session(session_id), api_key, kind)
+    return {"response": response, "freshness": freshness}
+
+async def submit_summary_job(request, kind):
+    session = await get_active_session(request.session_id, "No active conversation.")
+    job = jobs.submit(kind, session.session_id, functools.partial(summary_job, session.session_id, request.api_key, kind),
+                      request.priority)
+    return JSONResponse(status_code=202, content=job.to_dict(), headers={"Location": f"/jobs/{job.job_id}"})
 
 @app.post("/check_understanding", response_model=ConversationResponse)
 async def check_understanding(request: ApiKeyOnlyRequest):
-    if not assistant.current_topic:
-        raise HTTPException(status_code=400, detail="No active conversation.")
-    response = assistant.check_understanding(request.api_key)
-    return ConversationResponse(response=response)
+    session = await get_session(request.session_id)
+    response, freshness = await run_summary(session, request.api_key, "check_understanding")
+    return ConversationResponse(response=response, session_id=session.session_id, freshness=freshness)
+
+@app.post("/check_understanding/jobs", status_code=202)
+async def check_understanding_job(request: JobRequest):
+    return await submit_summary_job(request, "check_understanding")
+
+@app.post("/check_understanding/stream")
+async def stream_check_understanding(request: ApiKeyOnlyRequest):
+    session = await get_active_session(request.session_id, "No active conversation.")
+    return sse_response(session, request.api_key, "",
+                        session.assistant.stream_check_understanding, request.api_key, summary=True)
 
 @app.post("/conclude_topic", response_model=ConversationResponse)
 async def conclude_topic(request: ApiKeyOnlyRequest):
-    if not assistant.current_topic:
-        raise HTTPException(status_code=400, detail="No active conversation.")
-    response = assistant.conclude_topic(request.api_key)
-    return ConversationResponse(response=response)
+    session = await get_session(request.session_id)
+    response, freshness = await run_summary(session, request.api_key, "conclude_topic")
+    return ConversationResponse(response=response, session_id=session.session_id, freshness=freshness)
+
+@app.post("/conclude_topic/jobs", status_code=202)
+async def conclude_topic_job(request: JobRequest):
+    return await submit_summary_job(request, "conclude_topic")
+
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def poll_job(job_id: str):
+    return JSONResponse(get_job(job_id).to_dict())
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = get_job(job_id)
+
+    # A "status" event for each change while the job waits or runs, then "done" or "error" with the result
+    async def events():
+        while True:
+            status = job.status
+            if status in FINISHED:
+                yield format_sse(job.to_dict(), event="done" if status == "done" else "error")
+                return
+            yield format_sse(job.to_dict(), event="status")
+            await job.wait_change(status)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.post("/conclude_topic/stream")
+async def stream_conclude_topic(request: ApiKeyOnlyRequest):
+    session = await get_active_session(request.session_id, "No active conversation.")
+    return sse_response(session, request.api_key, "",
+                        session.assistant.stream_conclude_topic, request.api_key, summary=True)
 
 @app.post("/end_conversation", response_model=ConversationResponse)
-async def end_conversation():
-    response = assistant.end_conversation()
+async def end_conversation(request: SessionRequest):
+    session = await get_session(request.session_id)
+    async with session.lock:
+        response = session.assistant.end_conversation()
+    await sessions.remove(session.session_id)
     return ConversationResponse(response=response)
 
+async def socket_reply(session, outbox, ref, api_key, method, *args):
+    async with session.lock:
+        if not session.assistant.current_topic:
+            raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
+        async with scheduler.slot(api_key, request_tokens(session)):
+            text = await run_model_call(method, *args)
+        await sessions.save(session)
+    outbox.put({"type": "reply", "ref": ref, "text": text})
+
+async def socket_stream(session, outbox, ref, api_key, message, method, *args, summary=False):
+    async with session.lock:
+        if not session.assistant.current_topic:
+            raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
+        async with scheduler.slot(api_key, request_tokens(session, message)), \
+                aclosing(stream_model_call(method, *args)) as chunks:
+            async for chunk in chunks:
+                outbox.put({"type": "chunk", "ref": ref, "text": chunk})
+        await sessions.save(session)
+        if not summary:
+            schedule_precompute(session, api_key)
+    done = {"type": "done", "ref": ref}
+    if summary:
+        done["freshness"] = session.assistant.freshness
+    outbox.put(done)
+
+def frame_field(frame, name):
+    value = frame.get(name)
+    if not isinstance(value, str) or not value:
+        raise HTTPException(status_code=422, detail=f"'{frame.get('type')}' messages need a '{name}' string.")
+    return value
+
+SOCKET_COMMANDS = ("start", "message", "difficulty", "mode", "check_understanding", "conclude_topic", "end")
+
+async def run_socket_command(frame, session, outbox, api_key):
+    # Carries out one client message and returns the conversation's session afterwards
+    kind, ref = frame.get("type"), frame.get("id")
+    if kind not in SOCKET_COMMANDS:
+        raise HTTPException(status_code=400, detail=f"Unknown message type: {kind}")
+    if kind == "start":
+        if session is not None and session.assistant.current_topic:
+            raise HTTPException(status_code=409, detail="A conversation is already running on this connection.")
+        text, session = await open_session(frame_field(frame, "topic"), api_key, frame.get("difficulty", "medium"), outbox)
+        if session is None:
+            outbox.put({"type": "reply", "ref": ref, "text": text})
+            return None
+        outbox.put({"type": "started", "ref": ref, "session_id": session.session_id, "text": text})
+        return session
+    if session is None:
+        raise HTTPException(status_code=400, detail="No active conversation. Please start a conversation first.")
+
+    assistant = session.assistant
+    if kind == "message":
+        message = frame_field(frame, "text")
+        await socket_stream(session, outbox, ref, api_key, message, assistant.stream_process_response, message, api_key)
+    elif kind == "difficulty":
+        await socket_reply(session, outbox, ref, api_key, assistant.change_difficulty, frame_field(frame, "difficulty"), api_key)
+    elif kind == "mode":
+        await socket_reply(session, outbox, ref, api_key, assistant.switch_mode, frame_field(frame, "mode"), api_key)
+    elif kind == "check_understanding":
+        await socket_stream(session, outbox, ref, api_key, "", assistant.stream_check_understanding, api_key, summary=True)
+    elif kind == "conclude_topic":
+        await socket_stream(session, outbox, ref, api_key, "", assistant.stream_conclude_topic, api_key, summary=True)
+    elif kind == "end":
+        async with session.lock:
+            text = assistant.end_conversation()
+        await sessions.remove(session.session_id)
+        outbox.put({"type": "ended", "ref": ref, "text": text})
+        outbox.close()
+        return None
+    return session
+
+async def run_socket_commands(commands, session, outbox, api_key):
+    # Works through one connection's messages in order. It outlives the connection: whatever the
+    # client sent before dropping is still carried out, and the replies wait in the outbox for it to resume.
+    nudged = False
+    while True:
+        idle = (WS_NUDGE_SECONDS > 0 and not nudged and outbox.queue is not None
+                and session is not None and session.assistant.current_topic)
+        try:
+            frame = await (asyncio.wait_for(commands.get(), WS_NUDGE_SECONDS) if idle else commands.get())
+        except asyncio.TimeoutError:
+            outbox.put({"type": "nudge", "text": prompts.idle_nudge(session.assistant.current_topic, session.assistant.mode)})
+            nudged = True
+            continue
+        if frame is None:
+            return
+        nudged = False
+        try:
+            session = await run_socket_command(frame, session, outbox, api_key)
+        except Exception as exc:
+            outbox.put(dict(error_details(exc), type="error", ref=frame.get("id")))
+
+async def receive_frame(websocket, timeout):
+    # The next JSON object from the client, {} for anything else, or None once it is gone or silent.
+    # {} is answered like an unknown message type; receive_json raises KeyError for a binary frame.
+    try:
+        frame = await asyncio.wait_for(websocket.receive_json(), timeout)
+    except (KeyError, ValueError):
+        return {}
+    except (asyncio.TimeoutError, WebSocketDisconnect):
+        return None
+    return frame if isinstance(frame, dict) else {}
+
+async def receive_frames(websocket, commands, queue):
+    while True:
+        frame = await receive_frame(websocket, 2 * WS_HEARTBEAT_SECONDS)
+        if frame is None:
+            return
+        if frame.get("type") == "ping":
+            queue.put_nowait({"type": "pong"})
+        elif frame.get("type") != "pong":
+            commands.put_nowait(frame)
+
+async def send_frames(websocket, queue):
+    # Pings go out on a fixed timer, even mid-reply, so the client's pongs keep a long stream alive
+    loop = asyncio.get_running_loop()
+    next_ping = loop.time() + WS_HEARTBEAT_SECONDS
+    while True:
+        now = loop.time()
+        if now >= next_ping:
+            message = {"type": "ping"}
+            next_ping = now + WS_HEARTBEAT_SECONDS
+        else:
+            try:
+                message = await asyncio.wait_for(queue.get(), next_ping - now)
+            except asyncio.TimeoutError:
+                continue
+        if message is REPLACED:
+            await websocket.close(code=4000, reason="The conversation was resumed on another connection.")
+            return
+        if message is CLOSE:
+            await websocket.close(code=1000)
+            return
+        await websocket.send_json(message)
+
+@app.websocket("/ws/session")
+async def session_socket(websocket: WebSocket):
+    # One connection per conversation: the API key is sent once, then student messages, settings
+    # changes and streamed replies flow both ways. Server messages carry a seq; to resume after a
+    # drop, reconnect with the session_id and the last seq received.
+    await websocket.accept()
+    hello = await receive_frame(websocket, WS_HEARTBEAT_SECONDS)
+    if not hello or hello.get("type") != "auth" or not isinstance(hello.get("api_key"), str):
+        await websocket.close(code=1008, reason='Send {"type": "auth", "api_key": ...} first.')
+        return
+    api_key = hello["api_key"]
+
+    session = None
+    outbox = Outbox()
+    if hello.get("session_id"):
+        try:
+            session = await sessions.get(hello["session_id"])
+        except SessionNotFound:
+            await websocket.close(code=4404, reason="Unknown or expired session. Please start a new conversation.")
+            return
+        if session.outbox is None:
+            session.outbox = outbox
+        outbox = session.outbox
+    last_seq = hello.get("last_seq")
+    queue, complete = outbox.attach(last_seq if isinstance(last_seq, int) else None)
+    if session is not None:
+        metrics.WEBSOCKET_RESUMES.inc(complete=str(complete).lower())
+    await websocket.send_json({"type": "ready", "session_id": session.session_id if session else None,
+                               "seq": outbox.seq, "complete": complete})
+
+    commands = asyncio.Queue()
+    worker = asyncio.ensure_future(run_socket_commands(commands, session, outbox, api_key))
+    background_tasks.add(worker)
+    worker.add_done_callback(background_tasks.discard)
+    sockets.add(websocket)
+    receiver = asyncio.ensure_future(receive_frames(websocket, commands, queue))
+    sender = asyncio.ensure_future(send_frames(websocket, queue))
+    try:
+        await asyncio.wait([receiver, sender], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        sockets.discard(websocket)
+        commands.put_nowait(None)
+        outbox.detach(queue)
+        for task in (receiver, sender):
+            task.cancel()
+        if websocket.application_state == WebSocketState.CONNECTED:
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass  # The client closed it first
+
 @app.get("/available_topics", response_model=List[str])
 async def get_available_topics():
-    return list(assistant.knowledge_base.keys())
+    return list(knowledge_base.keys())
+
+@app.get("/topics/{topic}/related")
+async def get_related_topics(topic: str):
+    # Prerequisites, related topics, concepts and suggestions, straight from the topic graph in memory
+    try:
+        return JSONResponse(topic_graph.related(topic))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown topic: {topic}")
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class BackendError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(f"{status_code}: {detail}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class BackendClient:
+    # Thin client for backend.py that reuses keep-alive connections across Streamlit reruns.
+    # Failed connections are retried with exponential backoff, and so are gateway errors (502/503/504)
+    # on GETs. A POST that reached the backend is never sent again: a read timeout or a 504 may come
+    # after the turn was taken, and repeating it would add the student's message twice.
+    # The read timeout outlasts the backend's worst case, SOCRATEACH_SCHEDULER_MAX_WAIT (30s) in the
+    # queue plus SOCRATEACH_REQUEST_DEADLINE (120s) for the model calls.
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=180, retries=3, backoff_factor=0.5,
+                 pool_size=10, topics_ttl=300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.topics_ttl = topics_ttl
+        self._topics = None
+        self._topics_expires = 0.0
+        self._lock = threading.Lock()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _request(self, method, path, payload=None):
+        response = self.session.request(method, f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            raise BackendError(response.status_code, self._detail(response))
+        return response.json()
+
+    def _detail(self, response):
+        try:
+            return response.json().get("detail", response.text)
+        except ValueError:
+            return response.text
+
+    def available_topics(self):
+        # The topic list rarely changes, so serve it from memory between reruns
+        with self._lock:
+            if self._topics is not None and time.monotonic() < self._topics_expires:
+                return self._topics
+        topics = self._request("GET", "/available_topics")
+        with self._lock:
+            self._topics = topics
+            self._topics_expires = time.monotonic() + self.topics_ttl
+        return topics
+
+    def start_conversation(self, topic, api_key, difficulty):
+        return self._request("POST", "/start_conversation", {"topic": topic, "api_key": api_key, "difficulty": difficulty})
+
+    def process_response(self, session_id, message, api_key):
+        return self._request("POST", "/process_response", {"session_id": session_id, "message": message, "api_key": api_key})
+
+    def change_difficulty(self, session_id, difficulty, api_key):
+        return self._request("POST", "/change_difficulty", {"session_id": session_id, "difficulty": difficulty, "api_key": api_key})
+
+    def switch_mode(self, session_id, mode, api_key):
+        return self._request("POST", "/switch_mode", {"session_id": session_id, "message": mode, "api_key": api_key})
+
+    def check_understanding(self, session_id, api_key):
+        return self._request("POST", "/check_understanding", {"session_id": session_id, "api_key": api_key})
+
+    def conclude_topic(self, session_id, api_key):
+        return self._request("POST", "/conclude_topic", {"session_id": session_id, "api_key": api_key})
+
+    def end_conversation(self, session_id):
+        return self._request("POST", "/end_conversation", {"session_id": session_id})
+
+    def stream(self, path, payload, on_done=None):
+        # Yields the text chunks of a Server-Sent Events response from one of the /stream endpoints;
+        # on_done receives the payload of the final "done" event
+        with self.session.post(f"{self.base_url}{path}", json=payload, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise BackendError(response.status_code, self._detail(response))
+            event = "message"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    event = "message"
+                elif line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data = json.loads(line[len("data:"):])
+                    if event == "error":
+                        raise BackendError(502, data["detail"])
+                    if event == "message":
+                        yield data["text"]
+                    elif event == "done" and on_done is not None:
+                        on_done(data)
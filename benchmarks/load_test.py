@@ -0,0 +1,170 @@
+# Drives backend.py with many concurrent simulated students and reports latency percentiles
+# and throughput per endpoint. By default the app runs in-process against the local stub
+# provider, so no API key or network is needed:
+#
+#     python -m benchmarks.load_test --students 50 --turns 5
+#
+# Pass --base-url to load-test a running server instead, and --max-p95 to fail (exit code 1)
+# when any endpoint's p95 latency exceeds a budget, e.g. in CI.
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name, coroutine):
+        start = time.perf_counter()
+        try:
+            response = await coroutine
+        except Exception:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - start)
+        if not 200 <= response.status_code < 300:
+            self.errors[name] += 1
+            return None
+        return response
+
+    def report(self, elapsed):
+        rows = []
+        for name in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[name])
+            rows.append({
+                "endpoint": name,
+                "requests": len(values),
+                "errors": self.errors[name],
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+            })
+        return rows
+
+
+async def stream(client, path, payload):
+    # Measures time to the last byte of an SSE response; time to first chunk is recorded separately
+    first_chunk = None
+    start = time.perf_counter()
+    async with client.stream("POST", path, json=payload) as response:
+        async for line in response.aiter_lines():
+            if first_chunk is None and line.startswith("data:"):
+                first_chunk = time.perf_counter() - start
+    response.first_chunk = first_chunk
+    return response
+
+
+async def simulate_student(client, recorder, student, turns, api_key, measure_first_chunk):
+    topics = await recorder.call("GET /available_topics", client.get("/available_topics"))
+    topic = topics.json()[student % len(topics.json())] if topics is not None else "sorting"
+
+    started = await recorder.call("POST /start_conversation", client.post(
+        "/start_conversation", json={"topic": topic, "api_key": api_key, "difficulty": "medium"}))
+    if started is None:
+        return
+    session_id = started.json()["session_id"]
+
+    for turn in range(turns):
+        message = f"Student {student} answer {turn}: I think it compares neighbouring elements."
+        await recorder.call("POST /process_response", client.post(
+            "/process_response", json={"session_id": session_id, "message": message, "api_key": api_key}))
+
+    await recorder.call("POST /change_difficulty", client.post(
+        "/change_difficulty", json={"session_id": session_id, "difficulty": "hard", "api_key": api_key}))
+    await recorder.call("POST /switch_mode", client.post(
+        "/switch_mode", json={"session_id": session_id, "message": "Q&A", "api_key": api_key}))
+
+    streamed = await recorder.call("POST /process_response/stream", stream(
+        client, "/process_response/stream",
+        {"session_id": session_id, "message": "How does merge sort split the list?", "api_key": api_key}))
+    if measure_first_chunk and streamed is not None and streamed.first_chunk is not None:
+        recorder.latencies["POST /process_response/stream (first chunk)"].append(streamed.first_chunk)
+
+    await recorder.call("POST /check_understanding", client.post(
+        "/check_understanding", json={"session_id": session_id, "api_key": api_key}))
+    await recorder.call("POST /conclude_topic", client.post(
+        "/conclude_topic", json={"session_id": session_id, "api_key": api_key}))
+    await recorder.call("POST /end_conversation", client.post(
+        "/end_conversation", json={"session_id": session_id}))
+
+
+def make_client(args):
+    import httpx
+
+    timeout = httpx.Timeout(120.0)
+    limits = httpx.Limits(max_connections=args.students, max_keepalive_connections=args.students)
+    if args.base_url:
+        return httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits)
+
+    # Configure the in-process app before it is imported
+    os.environ.setdefault("SOCRATEACH_LLM_PROVIDER", "stub")
+    os.environ.setdefault("SOCRATEACH_STUB_LATENCY", str(args.stub_latency))
+    os.environ.setdefault("SOCRATEACH_STUB_TOKENS_PER_SECOND", str(args.stub_tokens_per_second))
+    os.environ.setdefault("SOCRATEACH_OPENER_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "openers.sqlite3"))
+    import backend
+
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app), base_url="http://backend",
+                             timeout=timeout, limits=limits)
+
+
+async def run(args):
+    recorder = Recorder()
+    async with make_client(args) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            # The in-process transport buffers whole responses, so time to first chunk is only meaningful over HTTP
+            simulate_student(client, recorder, student, args.turns, args.api_key, bool(args.base_url))
+            for student in range(args.students)
+        ))
+        elapsed = time.perf_counter() - start
+    return recorder.report(elapsed), elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Socratic Teaching Assistant backend.")
+    parser.add_argument("--students", type=int, default=20, help="concurrent simulated students")
+    parser.add_argument("--turns", type=int, default=5, help="process_response turns per student")
+    parser.add_argument("--base-url", help="test a running server instead of the in-process app")
+    parser.add_argument("--api-key", default="load-test", help="API key sent with each request")
+    parser.add_argument("--stub-latency", type=float, default=0.05, help="stub seconds to first token")
+    parser.add_argument("--stub-tokens-per-second", type=float, default=400, help="stub generation speed")
+    parser.add_argument("--max-p95", type=float, help="fail if any endpoint's p95 latency exceeds this many ms")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    rows, elapsed = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps({"elapsed_seconds": elapsed, "endpoints": rows}, indent=2))
+    else:
+        print(f"{args.students} students x {args.turns} turns in {elapsed:.2f}s")
+        print(f"{'endpoint':<46} {'reqs':>6} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8}")
+        for row in rows:
+            print(f"{row['endpoint']:<46} {row['requests']:>6} {row['errors']:>5} {row['p50_ms']:>9.1f} "
+                  f"{row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['throughput_rps']:>8.1f}")
+
+    failed = any(row["errors"] for row in rows)
+    if args.max_p95 is not None:
+        failed = failed or any(row["p95_ms"] > args.max_p95 for row in rows)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
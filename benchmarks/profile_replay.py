@@ -0,0 +1,198 @@
+# Replays a cassette of recorded traffic through backend.py under cProfile and reports where
+# the backend itself spends its time. Record a cassette first by serving real students, or any
+# other traffic, through the recording provider:
+#
+#     SOCRATEACH_LLM_PROVIDER=record SOCRATEACH_CASSETTE_PATH=cassette.jsonl uvicorn backend:app
+#
+# then profile the same conversations offline, with no API key or network:
+#
+#     python -m benchmarks.profile_replay --cassette cassette.jsonl
+#
+# The cassette holds the recorded requests next to the model calls they caused. Each conversation
+# is resent in order, with the conversations running concurrently (--pace 1 keeps their recorded
+# timing), and its prompts match their recordings. Conversations already running when the recording
+# began can't be replayed and are skipped.
+# A cassette recorded with SOCRATEACH_CASSETTE_HASH_ONLY=1 has no requests, only hashed model calls;
+# --synthetic drives the load test's simulated students instead, which match the cassette when it was
+# recorded from the load test with the same --students and --turns. Prompts that were never recorded
+# get a recorded answer picked by hash (counted as misses in the report).
+# By default the recorded latencies are dropped so the profile shows only the backend's own work;
+# --latency-scale 1 replays them as recorded.
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.load_test import Recorder, simulate_student, stream
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ThreadProfiler:
+    # cProfile only sees the thread that enabled it, and model calls, prompt building and history
+    # compaction all run on worker threads. Every thread started while profiling gets a profiler
+    # of its own, and the finished threads' stats are merged into the event loop thread's.
+    def __init__(self):
+        self.main = cProfile.Profile()
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.setprofile(self._start_thread)
+        self.main.enable()
+
+    def _start_thread(self, frame, event, arg):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.threads.append((threading.current_thread(), profile))
+        profile.enable()  # Replaces this hook for the rest of the thread's life
+
+    def stop(self):
+        self.main.disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(self.main)
+        for thread, profile in self.threads:
+            # A thread that is still running could be mid-update; the workers are shut down first
+            if not thread.is_alive():
+                stats.add(profile)
+        return stats
+
+
+def repo_function(filename):
+    # Builtins are reported as "~" and frozen modules as "<frozen ...>"
+    path = os.path.abspath(filename)
+    return os.path.isabs(filename) and path.startswith(ROOT + os.sep) and "site-packages" not in path and not path.startswith(os.path.join(ROOT, "benchmarks"))
+
+
+def hot_paths(stats, top, sort, everything):
+    rows = []
+    for (filename, line, name), (_, calls, self_time, cumulative, _) in stats.stats.items():
+        if not everything and not repo_function(filename):
+            continue
+        location = os.path.relpath(filename, ROOT) if repo_function(filename) else filename
+        rows.append({"function": f"{location}:{line}({name})", "calls": calls,
+                     "self_ms": self_time * 1000, "cumulative_ms": cumulative * 1000})
+    rows.sort(key=lambda row: row["cumulative_ms" if sort == "cumulative" else "self_ms"], reverse=True)
+    return rows[:top]
+
+
+async def replay_conversation(client, recorder, requests, api_key, pace, start):
+    # Resends one recorded conversation in order; returns how many of its requests were sent
+    session_id = None
+    for sent, request in enumerate(requests):
+        delay = request["at"] * pace - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        path = request["path"]
+        payload = dict(request["body"], api_key=api_key)
+        if path != "/start_conversation":
+            if session_id is None:
+                return sent  # Started before the recording, or its start failed
+            payload["session_id"] = session_id
+        call = stream(client, path, payload) if path.endswith("/stream") else client.post(path, json=payload)
+        response = await recorder.call(f"POST {path}", call)
+        if path == "/start_conversation":
+            session_id = response.json().get("session_id") if response is not None else None
+    return len(requests)
+
+
+async def replay(args, requests):
+    import httpx
+
+    import backend
+
+    recorder = Recorder()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=backend.app), base_url="http://backend",
+                                 timeout=httpx.Timeout(120.0)) as client:
+        start = time.perf_counter()
+        if requests:
+            conversations = {}
+            for request in requests:
+                conversations.setdefault(request["session"], []).append(request)
+            sent = await asyncio.gather(*(
+                replay_conversation(client, recorder, conversation, args.api_key, args.pace, start)
+                for conversation in conversations.values()
+            ))
+            workload = f"{sum(sent)} of {len(requests)} recorded requests from {len(conversations)} conversations"
+        else:
+            await asyncio.gather(*(
+                simulate_student(client, recorder, student, args.turns, args.api_key, False)
+                for student in range(args.students)
+            ))
+            workload = f"{args.students} students x {args.turns} turns"
+        elapsed = time.perf_counter() - start
+    return recorder.report(elapsed), elapsed, workload
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile the backend offline by replaying recorded model calls.")
+    parser.add_argument("--cassette", required=True, help="cassette recorded with SOCRATEACH_LLM_PROVIDER=record")
+    parser.add_argument("--pace", type=float, default=0.0,
+                        help="multiplier for the recorded request times; 0 sends each conversation's requests back to back")
+    parser.add_argument("--synthetic", action="store_true",
+                        help="drive simulated students instead of the recorded requests (implied for hash-only cassettes)")
+    parser.add_argument("--students", type=int, default=20, help="concurrent simulated students, with --synthetic")
+    parser.add_argument("--turns", type=int, default=5, help="process_response turns per student, with --synthetic")
+    parser.add_argument("--api-key", default="load-test", help="API key sent with each request")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="multiplier for the recorded model latencies")
+    parser.add_argument("--top", type=int, default=25, help="functions to list")
+    parser.add_argument("--sort", choices=["cumulative", "self"], default="cumulative", help="order of the hot-path list")
+    parser.add_argument("--all", action="store_true", help="include library functions, not just this repo's")
+    parser.add_argument("--pstats", help="also save the merged profile here, for snakeviz or pstats")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    # Configure the in-process app before it is imported
+    os.environ.update({
+        "SOCRATEACH_LLM_PROVIDER": "replay",
+        "SOCRATEACH_CASSETTE_PATH": os.path.abspath(args.cassette),
+        "SOCRATEACH_CASSETTE_LATENCY_SCALE": str(args.latency_scale),
+    })
+    os.environ.setdefault("SOCRATEACH_OPENER_CACHE_PATH", os.path.join(tempfile.mkdtemp(), "openers.sqlite3"))
+    import backend  # noqa: F401 - imported outside the profile, which covers serving only
+    from cassette import Cassette
+    import hedging
+    import metrics
+    import model_executor
+    import sessions
+
+    requests = [] if args.synthetic else Cassette(os.path.abspath(args.cassette)).requests()
+    profiler = ThreadProfiler()
+    profiler.start()
+    try:
+        rows, elapsed, workload = asyncio.run(replay(args, requests))
+    finally:
+        for executor in (model_executor.executor, hedging.executor, sessions.store_executor):
+            executor.shutdown(wait=True)
+        stats = profiler.stop()
+    if args.pstats:
+        stats.dump_stats(args.pstats)
+
+    replays = {key[0]: value for _, key, value in metrics.CASSETTE_REPLAYS.samples()}
+    functions = hot_paths(stats, args.top, args.sort, args.all)
+    if args.json:
+        print(json.dumps({"workload": workload, "elapsed_seconds": elapsed, "replays": replays, "endpoints": rows,
+                          "functions": functions}, indent=2))
+        return 0
+
+    print(f"Replayed {workload} in {elapsed:.2f}s "
+          f"({replays.get('hit', 0)} recorded answers, {replays.get('miss', 0)} unmatched prompts)")
+    print(f"{'endpoint':<46} {'reqs':>6} {'errs':>5} {'p50 ms':>9} {'p95 ms':>9}")
+    for row in rows:
+        print(f"{row['endpoint']:<46} {row['requests']:>6} {row['errors']:>5} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f}")
+    print()
+    print(f"Hot paths by {args.sort} time, all threads")
+    print(f"{'calls':>9} {'self ms':>10} {'cum ms':>10}  function")
+    for row in functions:
+        print(f"{row['calls']:>9} {row['self_ms']:>10.1f} {row['cumulative_ms']:>10.1f}  {row['function']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+# Measures cold start of both entry points: how long importing them takes and how slow the
+# first request is, each in a fresh interpreter. Requests go to the local stub provider, so
+# no API key or network is needed:
+#
+#     python -m benchmarks.startup --runs 5
+#
+# To compare before and after a change, run it on both checkouts (e.g. with `git stash`).
+# --prewarm measures with SOCRATEACH_PREWARM=1.
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure_backend():
+    timings = {}
+    start = time.perf_counter()
+    import backend
+    timings["import backend"] = time.perf_counter() - start
+
+    from fastapi.testclient import TestClient
+
+    start = time.perf_counter()
+    with TestClient(backend.app) as client:
+        timings["app startup"] = time.perf_counter() - start
+        start = time.perf_counter()
+        client.get("/available_topics").raise_for_status()
+        timings["first GET /available_topics"] = time.perf_counter() - start
+        start = time.perf_counter()
+        client.post("/start_conversation", json={"topic": "sorting", "api_key": "benchmark"}).raise_for_status()
+        timings["first POST /start_conversation"] = time.perf_counter() - start
+    return timings
+
+
+def measure_streamlit():
+    timings = {}
+    start = time.perf_counter()
+    import socrateachai
+    timings["import socrateachai"] = time.perf_counter() - start
+
+    if not hasattr(socrateachai, "prewarm"):
+        return timings  # Older checkouts have their own assistant that always calls Gemini
+
+    start = time.perf_counter()
+    assistant = socrateachai.SocraticTeachingAssistant()
+    assistant.start_conversation("sorting", "benchmark", "medium")
+    timings["first start_conversation"] = time.perf_counter() - start
+    return timings
+
+
+def measure_gemini_model():
+    # Builds (but never calls) a Gemini model: the first use of the real SDK
+    from providers import create_provider
+
+    timings = {}
+    provider = create_provider("gemini")
+    if os.environ.get("SOCRATEACH_PREWARM") == "1" and hasattr(provider, "prewarm"):
+        start = time.perf_counter()
+        provider.prewarm()
+        timings["Gemini prewarm"] = time.perf_counter() - start
+    start = time.perf_counter()
+    provider.get_model("benchmark", "gemini-1.5-pro", {"temperature": 0.3})
+    timings["first Gemini model"] = time.perf_counter() - start
+    return timings
+
+
+MEASUREMENTS = {
+    "backend": measure_backend,
+    "socrateachai": measure_streamlit,
+    "gemini": measure_gemini_model,
+}
+
+
+def run_child(name, prewarm):
+    env = dict(os.environ)
+    env.update({
+        "SOCRATEACH_LLM_PROVIDER": "stub",
+        "SOCRATEACH_STUB_LATENCY": "0",
+        "SOCRATEACH_STUB_TOKENS_PER_SECOND": "1000000",
+        "SOCRATEACH_OPENER_CACHE_VARIANTS": "0",
+        "SOCRATEACH_PREWARM": "1" if prewarm else "0",
+        "PYTHONWARNINGS": "ignore",
+    })
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", name],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold start of the backend and the Streamlit app.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per entry point")
+    parser.add_argument("--prewarm", action="store_true", help="start with SOCRATEACH_PREWARM=1")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--child", choices=sorted(MEASUREMENTS), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        # Keep the stub's opener cache and session files out of the working tree
+        os.chdir(tempfile.mkdtemp())
+        sys.path.insert(0, ROOT)
+        print(json.dumps(MEASUREMENTS[args.child]()))
+        return 0
+
+    samples = {}
+    for name in MEASUREMENTS:
+        for _ in range(args.runs):
+            for phase, seconds in run_child(name, args.prewarm).items():
+                samples.setdefault(phase, []).append(seconds)
+    rows = [{"phase": phase, "median_ms": statistics.median(values) * 1000, "max_ms": max(values) * 1000}
+            for phase, values in samples.items()]
+
+    if args.json:
+        print(json.dumps({"runs": args.runs, "prewarm": args.prewarm, "phases": rows}, indent=2))
+    else:
+        print(f"{args.runs} runs per entry point{' with prewarm' if args.prewarm else ''}")
+        print(f"{'phase':<36} {'median ms':>10} {'max ms':>10}")
+        for row in rows:
+            print(f"{row['phase']:<36} {row['median_ms']:>10.1f} {row['max_ms']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+
+import metrics
+from history import content_text
+from providers import LLMProvider, StubChunk, StubModel, StubResponse, StubUsage
+
+# "record" passes every model call through to SOCRATEACH_RECORD_PROVIDER and appends it to the
+# cassette; "replay" answers from the cassette alone, so recorded traffic can be rerun offline
+CASSETTE_PATH = os.environ.get("SOCRATEACH_CASSETTE_PATH", "model_cassette.jsonl")
+RECORD_PROVIDER = os.environ.get("SOCRATEACH_RECORD_PROVIDER", "gemini")
+# 1 replays the recorded latencies, 0 answers instantly, anything else scales them
+CASSETTE_LATENCY_SCALE = float(os.environ.get("SOCRATEACH_CASSETTE_LATENCY_SCALE", "1"))
+# Recording also saves the requests that caused the model calls, student messages included, so the
+# traffic can be replayed as it came; "1" keeps only the model calls, with prompts as hashes
+CASSETTE_HASH_ONLY = os.environ.get("SOCRATEACH_CASSETTE_HASH_ONLY", "0") == "1"
+
+
+def prompt_key(model_name, contents):
+    # Calls are matched on the model and the newest prompt; whatever history precedes it was
+    # built from earlier prompts, so it matches whenever those did
+    prompt = content_text(contents[-1]) if isinstance(contents, list) else str(contents)
+    return hashlib.sha256(f"{model_name}\n{prompt}".encode("utf-8")).hexdigest()[:16]
+
+
+def usage_counts(response):
+    usage = getattr(response, "usage_metadata", None)
+    return [getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0]
+
+
+class Cassette:
+    # Append-only JSON lines, one model call per line:
+    #   {"key": ..., "model": ..., "text": ..., "chunks": [...], "first": 0.41, "total": 2.3, "usage": [812, 95]}
+    # "first" and "total" are seconds to the first chunk and to the end; "chunks" is only there for
+    # streamed calls. Prompts are kept as a hash of the prompt, never in the clear. Unless hash-only,
+    # the inbound requests are interleaved, one per line:
+    #   {"request": {"path": "/process_response", "session": 3, "at": 12.5, "body": {"message": ...}}}
+    # "session" numbers the conversations in order of appearance and "at" is seconds since recording began.
+    def __init__(self, path=CASSETTE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line)
+
+    def load(self):
+        entries = []
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue  # A line cut short when the recording process died
+        return entries
+
+    def requests(self):
+        # The recorded requests in the order they arrived; each line was written once it finished
+        return sorted((entry["request"] for entry in self.load() if "request" in entry), key=lambda request: request["at"])
+
+
+class RecordedStream:
+    # Hands the wrapped stream's chunks through and records the call once the last one arrived
+    def __init__(self, model, key, response, start):
+        self._model = model
+        self._key = key
+        self._response = response
+        self._start = start
+
+    def __iter__(self):
+        chunks = []
+        first = None
+        for chunk in self._response:
+            if first is None:
+                first = time.perf_counter() - self._start
+            chunks.append(chunk.text)
+            yield chunk
+        total = time.perf_counter() - self._start
+        self._model.save(self._key, "".join(chunks), first if first is not None else total, total, self._response, chunks)
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+class RecordingChatSession:
+    def __init__(self, model, session):
+        self._model = model
+        self.session = session
+
+    @property
+    def model(self):
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        # The assistant switches tiers by rebinding the model; the wrapped session must follow
+        self._model = model
+        self.session.model = model.model
+
+    @property
+    def history(self):
+        return self.session.history
+
+    @history.setter
+    def history(self, history):
+        self.session.history = history
+
+    def send_message(self, content, stream=False, **kwargs):
+        return self._model.record(self.session.send_message, content, stream, **kwargs)
+
+    def rewind(self):
+        return self.session.rewind()
+
+
+class RecordingModel:
+    def __init__(self, cassette, model, model_name):
+        self.cassette = cassette
+        self.model = model
+        self.model_name = model_name
+
+    def start_chat(self, history=None):
+        return RecordingChatSession(self, self.model.start_chat(history=history))
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return self.record(self.model.generate_content, contents, stream, **kwargs)
+
+    def record(self, func, contents, stream, **kwargs):
+        key = prompt_key(self.model_name, contents)
+        start = time.perf_counter()
+        response = func(contents, stream=stream, **kwargs)
+        if stream:
+            return RecordedStream(self, key, response, start)
+        total = time.perf_counter() - start
+        self.save(key, response.text, total, total, response)
+        return response
+
+    def save(self, key, text, first, total, response, chunks=None):
+        entry = {"key": key, "model": self.model_name, "text": text,
+                 "first": round(first, 4), "total": round(total, 4), "usage": usage_counts(response)}
+        if chunks is not None:
+            entry["chunks"] = chunks
+        self.cassette.append(entry)
+
+
+class RecordingProvider(LLMProvider):
+    name = "record"
+
+    def __init__(self, provider, cassette=None):
+        self.provider = provider
+        self.cassette = cassette if cassette is not None else Cassette()
+
+    def get_model(self, api_key, model_name, generation_config, system_instruction=None):
+        model = self.provider.get_model(api_key, model_name, generation_config, system_instruction)
+        return RecordingModel(self.cassette, model, model_name)
+
+    def prewarm(self):
+        self.provider.prewarm()
+
+
+class RequestRecorder:
+    # ASGI middleware, installed by backend.py when recording: appends each conversation request to
+    # the cassette without its API key and with its session numbered, so benchmarks/profile_replay.py
+    # can resend the same conversations. Batches and /ws/session traffic are not recorded.
+    def __init__(self, app, cassette):
+        self.app = app
+        self.cassette = cassette
+        self.sessions = {}  # session_id -> number
+        self._numbers = itertools.count()
+        self._start = time.monotonic()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        arrived = time.monotonic() - self._start
+        body = []
+        reply = []  # Only kept for /start_conversation, which hands out the session_id
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.body" and scope["path"] == "/start_conversation":
+                reply.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            self.record(scope["path"], arrived, b"".join(body), b"".join(reply))
+
+    def record(self, path, arrived, body, reply):
+        try:
+            request = json.loads(body)
+            started = json.loads(reply) if reply else {}
+        except ValueError:
+            return
+        if not isinstance(request, dict):
+            return
+        if path == "/start_conversation":
+            session_id = started.get("session_id") if isinstance(started, dict) else None
+        elif isinstance(request.get("session_id"), str):
+            session_id = request["session_id"]
+        else:
+            return  # Not part of one conversation
+        if session_id is None:
+            number = next(self._numbers)  # A start that didn't open a conversation
+        elif session_id in self.sessions:
+            number = self.sessions[session_id]
+        else:
+            number = self.sessions[session_id] = next(self._numbers)
+        self.cassette.append({"request": {
+            "path": path, "session": number, "at": round(arrived, 4),
+            "body": {name: value for name, value in request.items() if name not in ("api_key", "session_id")},
+        }})
+
+
+def pause(seconds):
+    # With the latencies scaled to zero, don't even yield the GIL: profiles stay free of thread switches
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+class ReplayResponse(StubResponse):
+    # A recorded call played back with its latencies multiplied by the provider's scale
+    def __init__(self, entry, scale, stream, on_complete=None, timeout=None):
+        self.text = entry["text"]
+        self.usage_metadata = StubUsage(*entry["usage"])
+        self.entry = entry
+        self.scale = scale
+        self._on_complete = on_complete
+        duration = (entry["first"] if stream else entry["total"]) * scale
+        if timeout is not None and duration > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Replayed request timed out")
+        if not stream:
+            pause(duration)
+            self._complete()
+
+    def __iter__(self):
+        chunks = self.entry.get("chunks") or [self.text]
+        pause(self.entry["first"] * self.scale)
+        gap = max(0.0, self.entry["total"] - self.entry["first"]) * self.scale / max(1, len(chunks) - 1)
+        for index, text in enumerate(chunks):
+            if index:
+                pause(gap)
+            yield StubChunk(text)
+        self._complete()
+
+
+class ReplayModel(StubModel):
+    def respond(self, contents, stream, on_complete=None, request_options=None):
+        entry = self.provider.lookup(self.model_name, contents)
+        timeout = (request_options or {}).get("timeout")
+        return ReplayResponse(entry, self.provider.latency_scale, stream, on_complete, timeout)
+
+
+class ReplayProvider(LLMProvider):
+    # Serves recorded answers deterministically. A prompt recorded several times gets its recordings
+    # in the order they were made; a prompt that was never recorded gets one picked by its hash
+    # from the same model's recordings, so a changed prompt still replays with realistic sizes and timings.
+    name = "replay"
+
+    def __init__(self, cassette=None, latency_scale=CASSETTE_LATENCY_SCALE):
+        cassette = cassette if cassette is not None else Cassette()
+        self.entries = [entry for entry in cassette.load() if "key" in entry]
+        if not self.entries:
+            raise ValueError(f"No recorded model calls in {cassette.path}")
+        self.latency_scale = latency_scale
+        self.by_key = {}
+        self.by_model = {}
+        for entry in self.entries:
+            self.by_key.setdefault(entry["key"], []).append(entry)
+            self.by_model.setdefault(entry["model"], []).append(entry)
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def get_model(self, api_key, model_name, generation_config, system_instruction=None):
+        return ReplayModel(self, model_name, system_instruction)
+
+    def lookup(self, model_name, contents):
+        key = prompt_key(model_name, contents)
+        recorded = self.by_key.get(key)
+        if recorded is None:
+            metrics.CASSETTE_REPLAYS.inc(result="miss")
+            candidates = self.by_model.get(model_name, self.entries)
+            return candidates[int(key, 16) % len(candidates)]
+        metrics.CASSETTE_REPLAYS.inc(result="hit")
+        with self._lock:
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+        return recorded[position % len(recorded)]
@@ -0,0 +1,57 @@
+import json
+import os
+import zlib
+
+import streamlit as st
+
+# Messages rendered on each rerun; earlier ones are drawn only when the student asks for them
+CHAT_WINDOW = int(os.environ.get("SOCRATEACH_CHAT_WINDOW", "20"))
+
+
+class ChatHistory:
+    # The conversation shown in the chat area. The most recent messages are kept as (role, message)
+    # tuples, older ones are packed into zlib-compressed blocks that are only unpacked when scrolled back to.
+    def __init__(self, window=CHAT_WINDOW):
+        self.window = window
+        self.recent = []
+        self.blocks = []  # Compressed JSON lists of `window` messages each, oldest first
+
+    def __len__(self):
+        return len(self.blocks) * self.window + len(self.recent)
+
+    def append(self, role, message):
+        self.recent.append((role, message))
+        if len(self.recent) >= 2 * self.window:
+            block, self.recent = self.recent[:self.window], self.recent[self.window:]
+            self.blocks.append(zlib.compress(json.dumps(block).encode("utf-8")))
+
+    def tail(self, count):
+        # The last `count` messages as (index, role, message), unpacking only the blocks needed
+        count = min(count, len(self))
+        messages = list(self.recent)
+        block = len(self.blocks)
+        while len(messages) < count:
+            block -= 1
+            messages = [tuple(entry) for entry in json.loads(zlib.decompress(self.blocks[block]))] + messages
+        start = len(self) - count
+        return [(start + offset, role, message) for offset, (role, message) in enumerate(messages[len(messages) - count:])]
+
+
+def render_history(history, captions=None):
+    # Draws the last CHAT_WINDOW messages, plus however many earlier ones have been loaded
+    if "chat_shown" not in st.session_state:
+        st.session_state.chat_shown = history.window
+    hidden = len(history) - st.session_state.chat_shown
+    if hidden > 0:
+        st.caption(f"{hidden} earlier messages hidden")
+        if st.button("Show earlier messages", key="show_earlier_messages"):
+            st.session_state.chat_shown += history.window
+    for index, role, message in history.tail(st.session_state.chat_shown):
+        with st.chat_message(role):
+            st.write(message)
+            if captions and index in captions:
+                st.caption(captions[index])
+
+
+def reset_history_view():
+    st.session_state.chat_shown = CHAT_WINDOW
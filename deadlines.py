@@ -0,0 +1,106 @@
+import contextvars
+import os
+import threading
+import time
+
+# Longest a single upstream call may take, and the budget for all the calls one request makes
+MODEL_TIMEOUT = float(os.environ.get("SOCRATEACH_MODEL_TIMEOUT", "60"))
+REQUEST_DEADLINE = float(os.environ.get("SOCRATEACH_REQUEST_DEADLINE", "120"))
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, detail="The model took too long to answer. Please try again."):
+        super().__init__(detail)
+
+
+class CallCancelled(Exception):
+    pass
+
+
+_local = threading.local()
+
+# Set by the scheduler while a request holds its slot: a function that charges one more upstream
+# call to the request's API key, from any thread, and returns False if the key has no room for it
+extra_call_quota = contextvars.ContextVar("extra_call_quota", default=None)
+
+
+class CallScope:
+    # The deadline and cancellation flag shared by every upstream call made for one request.
+    # Model calls block a worker thread, so they can't be interrupted; instead each call gets an
+    # SDK timeout that fits the deadline, and nothing new starts once the scope is cancelled.
+    def __init__(self, seconds=REQUEST_DEADLINE):
+        self.expires = time.monotonic() + seconds
+        self.cancelled = threading.Event()
+        self.charge_extra_call = extra_call_quota.get()  # Scopes are created on the event loop, inside the slot
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def remaining(self):
+        return self.expires - time.monotonic()
+
+    def run(self, func, *args, **kwargs):
+        previous = getattr(_local, "scope", None)
+        _local.scope = self
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.scope = previous
+
+    def iterate(self, func, *args, **kwargs):
+        # Like run(), for a generator that is consumed on this thread
+        previous = getattr(_local, "scope", None)
+        _local.scope = self
+        try:
+            yield from func(*args, **kwargs)
+        finally:
+            _local.scope = previous
+
+
+def current_scope():
+    return getattr(_local, "scope", None)
+
+
+def carry(func):
+    # Wraps func to run under the calling thread's scope, e.g. on another pool
+    scope = current_scope()
+    if scope is None:
+        return func
+    return lambda *args, **kwargs: scope.run(func, *args, **kwargs)
+
+
+def call_timeout():
+    scope = current_scope()
+    if scope is None:
+        return MODEL_TIMEOUT
+    if scope.cancelled.is_set():
+        raise CallCancelled()
+    remaining = scope.remaining()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return min(MODEL_TIMEOUT, remaining)
+
+
+def timed_call(func, *args, **kwargs):
+    # One upstream call, with the SDK timeout set to whatever is shorter: the per-call limit or
+    # what is left of the request's deadline
+    timeout = call_timeout()
+    start = time.monotonic()
+    try:
+        return func(*args, request_options={"timeout": timeout}, **kwargs)
+    except Exception as exc:
+        if time.monotonic() - start >= timeout or getattr(exc, "code", None) == 504:
+            raise DeadlineExceeded() from exc
+        raise
+
+
+def sleep(seconds):
+    # Backoff sleep that gives up early instead of overrunning the deadline
+    scope = current_scope()
+    if scope is not None:
+        if scope.remaining() <= seconds:
+            raise DeadlineExceeded()
+        if scope.cancelled.wait(seconds):
+            raise CallCancelled()
+        return
+    time.sleep(seconds)
@@ -0,0 +1,62 @@
+import asyncio
+
+
+class CancelOnDisconnectMiddleware:
+    # Cancels a request's handler as soon as the client hangs up, so abandoned requests stop
+    # waiting for quota and start no further model calls (see model_executor.run_model_call).
+    # Add it inside MetricsMiddleware, which then records such requests with status 499.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        body_read = asyncio.Event()
+        disconnected = asyncio.Event()
+        started = False
+
+        async def receive_wrapper():
+            if body_read.is_set():
+                # Only the disconnect is left to receive, and the watcher below is waiting for it
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            if message["type"] == "http.disconnect" or not message.get("more_body", False):
+                body_read.set()
+            return message
+
+        async def send_wrapper(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        async def watch():
+            await body_read.wait()
+            if not disconnected.is_set() and (await receive())["type"] == "http.disconnect":
+                disconnected.set()
+
+        handler = asyncio.ensure_future(self.app(scope, receive_wrapper, send_wrapper))
+        watcher = asyncio.ensure_future(watch())
+        hung_up = asyncio.ensure_future(disconnected.wait())
+        try:
+            await asyncio.wait([handler, hung_up], return_when=asyncio.FIRST_COMPLETED)
+            if handler.done():
+                handler.result()
+                return
+            handler.cancel()
+            try:
+                await handler
+            except BaseException:
+                pass  # Nobody is left to report it to
+            if not started:
+                # The server drops this, but it lets the metrics record the request as abandoned
+                await send({"type": "http.response.start", "status": 499, "headers": []})
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            for task in (handler, watcher, hung_up):
+                task.cancel()
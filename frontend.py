@@ -1,9 +1,18 @@
 import streamlit as st
 import requests
 from PIL import Image
+from backend_client import BackendClient, BackendError
+from chat_view import ChatHistory, render_history, reset_history_view
 
 BASE_URL = "http://localhost:8000"
 
+# One pooled client per Streamlit server, shared by every rerun and browser session
+@st.cache_resource
+def get_client():
+    return BackendClient(BASE_URL)
+
+client = get_client()
+
 # Load and display the logo
 logo = Image.open("logo.png")
 st.image(logo, width=200)
@@ -17,7 +26,7 @@ with st.sidebar:
 
 # Initialize session state
 if 'messages' not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.messages = ChatHistory()
 
 if 'conversation_active' not in st.session_state:
     st.session_state.conversation_active = False
@@ -28,9 +37,44 @@ if 'difficulty' not in st.session_state:
 if 'mode' not in st.session_state:
     st.session_state.mode = "Socratic"
 
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = None
+
+if 'pending_action' not in st.session_state:
+    st.session_state.pending_action = None
+
+if 'freshness_note' not in st.session_state:
+    st.session_state.freshness_note = None
+
+# Renders a streamed assistant reply as it arrives and returns the full text, or None on failure
+def stream_assistant_reply(path, payload):
+    done = {}
+    with st.chat_message("assistant"):
+        try:
+            reply = st.write_stream(client.stream(path, payload, on_done=done.update))
+            freshness = done.get("freshness")
+            if freshness and freshness["precomputed"]:
+                # Shown under this reply, which becomes the next entry in the history
+                st.session_state.freshness_note = (
+                    len(st.session_state.messages),
+                    f"Prepared in the background {freshness['age_seconds']:.0f}s ago, up to date with your latest answer.",
+                )
+            return reply
+        except (requests.RequestException, BackendError) as error:
+            st.error(f"Failed to get a response: {error}")
+            return None
+
 # Function to start a new conversation
 def start_new_conversation():
-    st.session_state.messages = []
+    if st.session_state.session_id:
+        try:
+            client.end_conversation(st.session_state.session_id)
+        except (requests.RequestException, BackendError):
+            pass  # The backend drops idle sessions on its own
+    st.session_state.session_id = None
+    st.session_state.messages = ChatHistory()
+    reset_history_view()
+    st.session_state.freshness_note = None
     st.session_state.conversation_active = False
     st.session_state.difficulty = "medium"
     st.session_state.mode = "Socratic"
@@ -41,53 +85,46 @@ with st.sidebar:
         st.error("Please enter your Gemini API Key to start.")
     elif not st.session_state.conversation_active:
         st.subheader("Start a New Conversation")
-        response = requests.get(f"{BASE_URL}/available_topics")
-        topics = response.json()
+        topics = client.available_topics()
         selected_topic = st.selectbox("Choose a topic:", topics)
         difficulty = st.select_slider("Select difficulty:", options=["easy", "medium", "hard"], value="medium")
         if st.button("Start Conversation"):
-            response = requests.post(f"{BASE_URL}/start_conversation", json={"topic": selected_topic, "api_key": api_key, "difficulty": difficulty})
-            if response.status_code == 200:
-                st.session_state.messages.append(("assistant", response.json()["response"]))
+            try:
+                response = client.start_conversation(selected_topic, api_key, difficulty)
+                st.session_state.messages.append("assistant", response["response"])
+                st.session_state.session_id = response["session_id"]
                 st.session_state.conversation_active = True
                 st.session_state.difficulty = difficulty
-            else:
+            except (requests.RequestException, BackendError):
                 st.error("Failed to start conversation. Please check your API key.")
     else:
         st.subheader("Conversation Settings")
         new_difficulty = st.select_slider("Adjust difficulty:", options=["easy", "medium", "hard"], value=st.session_state.difficulty)
         if new_difficulty != st.session_state.difficulty:
-            response = requests.post(f"{BASE_URL}/change_difficulty", json={"difficulty": new_difficulty, "api_key": api_key})
-            if response.status_code == 200:
-                st.session_state.messages.append(("assistant", response.json()["response"]))
+            try:
+                response = client.change_difficulty(st.session_state.session_id, new_difficulty, api_key)
+                st.session_state.messages.append("assistant", response["response"])
                 st.session_state.difficulty = new_difficulty
                 st.rerun()
+            except (requests.RequestException, BackendError) as error:
+                st.error(f"Failed to change difficulty: {error}")
         
+        # The summaries are streamed into the chat area below the history
         if st.button("Check Understanding"):
-            response = requests.post(f"{BASE_URL}/check_understanding", json={"api_key": api_key})
-            if response.status_code == 200:
-                st.session_state.messages.append(("assistant", response.json()["response"]))
-                st.rerun()
-            else:
-                st.error(f"Failed to check understanding. Status code: {response.status_code}")
+            st.session_state.pending_action = "check_understanding"
 
         if st.button("Conclude Topic"):
-            response = requests.post(f"{BASE_URL}/conclude_topic", json={"api_key": api_key})
-            if response.status_code == 200:
-                st.session_state.messages.append(("assistant", response.json()["response"]))
-                st.session_state.conversation_active = False
-                st.rerun()
-            else:
-                st.error(f"Failed to conclude topic. Status code: {response.status_code}")
+            st.session_state.pending_action = "conclude_topic"
 
         if st.button("End Conversation"):
-            response = requests.post(f"{BASE_URL}/end_conversation")
-            if response.status_code == 200:
-                st.session_state.messages.append(("assistant", response.json()["response"]))
+            try:
+                response = client.end_conversation(st.session_state.session_id)
+                st.session_state.messages.append("assistant", response["response"])
+                st.session_state.session_id = None
                 st.session_state.conversation_active = False
                 st.rerun()
-            else:
-                st.error(f"Failed to end conversation. Status code: {response.status_code}")
+            except (requests.RequestException, BackendError) as error:
+                st.error(f"Failed to end conversation: {error}")
 
 # Mode selection and explanation (outside the sidebar)
 if st.session_state.conversation_active:
@@ -96,35 +133,45 @@ if st.session_state.conversation_active:
     with col1:
         new_mode = st.radio("Select mode:", ["Socratic", "Q&A"])
         if new_mode != st.session_state.mode:
-            response = requests.post(f"{BASE_URL}/switch_mode", json={"message": new_mode, "api_key": api_key})
-            if response.status_code == 200:
-                st.session_state.messages.append(("assistant", response.json()["response"]))
+            try:
+                response = client.switch_mode(st.session_state.session_id, new_mode, api_key)
+                st.session_state.messages.append("assistant", response["response"])
                 st.session_state.mode = new_mode
                 st.rerun()
+            except (requests.RequestException, BackendError) as error:
+                st.error(f"Failed to switch mode: {error}")
     with col2:
         if st.session_state.mode == "Socratic":
             st.info("In Socratic mode, the assistant will guide you through learning using questions and prompts.")
         else:
             st.info("In Q&A mode, you can ask direct questions about the current topic, and the assistant will provide answers.")
 
-# Display conversation history
-for role, message in st.session_state.messages:
-    with st.chat_message(role):
-        st.write(message)
+# Display the recent conversation history; older messages load on demand
+note = st.session_state.freshness_note
+render_history(st.session_state.messages, captions=dict([note]) if note else None)
+
+# Check Understanding / Conclude Topic requested from the sidebar
+if st.session_state.pending_action and st.session_state.conversation_active:
+    action = st.session_state.pending_action
+    st.session_state.pending_action = None
+    assistant_response = stream_assistant_reply(f"/{action}/stream", {"session_id": st.session_state.session_id, "api_key": api_key})
+    if assistant_response is not None:
+        st.session_state.messages.append("assistant", assistant_response)
+        if action == "conclude_topic":
+            st.session_state.conversation_active = False
+        st.rerun()
 
 # User input
 if st.session_state.conversation_active and api_key:
     user_input = st.chat_input("Your response:" if st.session_state.mode == "Socratic" else "Your question:")
     if user_input:
-        st.session_state.messages.append(("user", user_input))
-        response = requests.post(f"{BASE_URL}/process_response", json={"message": user_input, "api_key": api_key})
-        
-        if response.status_code == 200:
-            assistant_response = response.json()["response"]
-            st.session_state.messages.append(("assistant", assistant_response))
-            st.rerun()
-        else:
-            st.error("Failed to process response. Please check your API key.")
+        st.session_state.messages.append("user", user_input)
+        with st.chat_message("user"):
+            st.write(user_input)
+        assistant_response = stream_assistant_reply("/process_response/stream", {"session_id": st.session_state.session_id, "message": user_input, "api_key": api_key})
+        if assistant_response is not None:
+            # Both messages are already on screen, so there is no need for a full rerun
+            st.session_state.messages.append("assistant", assistant_response)
 
 # Option to start a new conversation
 if st.session_state.conversation_active:
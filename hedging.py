@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import metrics
+from deadlines import carry, current_scope
+from model_executor import MODEL_WORKERS
+
+# Side calls that are safe to send twice (summaries, openers) may be hedged: if the first request
+# hasn't answered by the observed latency percentile, a second one is sent and the first answer wins.
+# The loser isn't cancelled (a blocking SDK call can't be) and is billed like any other call, so the
+# hedge is charged to the API key's quota and only sent when the scheduler has room for it.
+HEDGING = os.environ.get("SOCRATEACH_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.environ.get("SOCRATEACH_HEDGE_PERCENTILE", "0.95"))
+HEDGE_MIN_SAMPLES = 20  # Below this there is no meaningful percentile to wait for
+LATENCY_WINDOW = 200
+
+# Hedged requests run here so they never wait behind the model workers that issue them
+executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="socrateach-hedge")
+
+
+class LatencyTracker:
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, call, seconds):
+        with self._lock:
+            self._samples.setdefault(call, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, call, fraction):
+        with self._lock:
+            samples = sorted(self._samples.get(call, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+tracker = LatencyTracker()
+
+
+def hedged_call(call, func, *args, **kwargs):
+    if not HEDGING:
+        return func(*args, **kwargs)
+    delay = tracker.percentile(call, HEDGE_PERCENTILE)
+    if delay is None:
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        tracker.record(call, time.perf_counter() - start)
+        return result
+
+    task = carry(func)
+    futures = [submit(call, task, *args, **kwargs)]
+    done, _ = wait(futures, timeout=delay)
+    if not done:
+        scope = current_scope()
+        if scope is not None and scope.charge_extra_call is not None and not scope.charge_extra_call():
+            metrics.HEDGES_SKIPPED.inc(call=call)
+        else:
+            metrics.HEDGED_REQUESTS.inc(call=call)
+            futures.append(submit(call, task, *args, **kwargs))
+    pending = set(futures)
+    while True:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not futures[0]:
+                    metrics.HEDGE_WINS.inc(call=call)
+                return future.result()
+        if not pending:
+            # Both failed; report the original request's error
+            return futures[0].result()
+
+
+def submit(call, func, *args, **kwargs):
+    start = time.perf_counter()
+    future = executor.submit(func, *args, **kwargs)
+
+    def record(future):
+        if future.exception() is None:
+            tracker.record(call, time.perf_counter() - start)
+
+    future.add_done_callback(record)
+    return future
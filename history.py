@@ -0,0 +1,81 @@
+import os
+
+HISTORY_TOKEN_BUDGET = int(os.environ.get("SOCRATEACH_HISTORY_TOKEN_BUDGET", "6000"))
+HISTORY_KEEP_TURNS = int(os.environ.get("SOCRATEACH_HISTORY_KEEP_TURNS", "4"))
+
+SUMMARY_PROMPT = """
+Summarize the following part of a tutoring conversation between a teaching assistant and a student.
+Keep the concepts covered, the questions asked, what the student understood or struggled with,
+and any open questions, in at most 150 words.
+
+{transcript}
+"""
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token; good enough for deciding when to compact
+    return len(text) // 4 + 1
+
+
+def content_role(content):
+    return content["role"] if isinstance(content, dict) else content.role
+
+
+def content_text(content):
+    parts = content["parts"] if isinstance(content, dict) else content.parts
+    return "".join(part if isinstance(part, str) else part.text for part in parts)
+
+
+class HistoryManager:
+    # Keeps the chat history under a token budget by folding older turns into a summary.
+    # The opening exchange and the last `keep_turns` exchanges are always kept verbatim.
+    def __init__(self, token_budget=HISTORY_TOKEN_BUDGET, keep_turns=HISTORY_KEEP_TURNS):
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self.tokens_saved_per_turn = 0  # History tokens no longer resent with each message
+        self.tokens_saved_total = 0
+        self.compactions = 0
+
+    def to_state(self):
+        return {
+            "tokens_saved_per_turn": self.tokens_saved_per_turn,
+            "tokens_saved_total": self.tokens_saved_total,
+            "compactions": self.compactions,
+        }
+
+    def restore_state(self, state):
+        self.tokens_saved_per_turn = state["tokens_saved_per_turn"]
+        self.tokens_saved_total = state["tokens_saved_total"]
+        self.compactions = state["compactions"]
+
+    def history_tokens(self, history):
+        return sum(estimate_tokens(content_text(content)) for content in history)
+
+    def record_turn(self):
+        self.tokens_saved_total += self.tokens_saved_per_turn
+
+    def maybe_compact(self, chat_session, summarize):
+        if self.token_budget <= 0:
+            return False
+        history = chat_session.history
+        if self.history_tokens(history) <= self.token_budget:
+            return False
+
+        keep = 2 * self.keep_turns
+        older = history[2:len(history) - keep]
+        # Fold in batches of at least `keep_turns` exchanges rather than paying for a summary every turn
+        unsummarized = len(older) - (2 if self.compactions else 0)
+        if unsummarized < max(2, keep):
+            return False
+
+        transcript = "\n".join(f"{content_role(content)}: {content_text(content)}" for content in older)
+        summary = summarize(SUMMARY_PROMPT.format(transcript=transcript))
+        folded = [
+            {"role": "user", "parts": [f"Summary of our conversation so far: {summary}"]},
+            {"role": "model", "parts": ["Understood. I'll continue the lesson from there."]},
+        ]
+        chat_session.history = history[:2] + folded + history[len(history) - keep:]
+
+        self.tokens_saved_per_turn += self.history_tokens(older) - self.history_tokens(folded)
+        self.compactions += 1
+        return True
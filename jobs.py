@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import os
+import time
+import uuid
+from collections import deque
+
+import metrics
+from scheduler import RateLimited
+
+JOB_WORKERS = int(os.environ.get("SOCRATEACH_JOB_WORKERS", "4"))
+JOB_MAX_QUEUE = int(os.environ.get("SOCRATEACH_JOB_MAX_QUEUE", "256"))
+# Finished jobs are kept this long for their clients to collect
+JOB_TTL_SECONDS = float(os.environ.get("SOCRATEACH_JOB_TTL", "600"))
+
+# Lower runs first; jobs of the same priority run in the order they were submitted
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+FINISHED = ("done", "failed")
+
+
+class Job:
+    def __init__(self, kind, session_id, priority, run):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.session_id = session_id
+        self.priority = priority
+        self.run = run  # Coroutine function returning the result, a dict
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.monotonic()
+        self.started = None
+        self.finished = None
+        self._changed = asyncio.Event()
+
+    def set_status(self, status):
+        self.status = status
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_change(self, status):
+        # Returns once the job has moved on from `status`
+        changed = self._changed
+        if self.status == status:
+            await changed.wait()
+
+    def to_dict(self):
+        now = time.monotonic()
+        job = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "session_id": self.session_id,
+            "priority": self.priority,
+            "status": self.status,
+            "queued_seconds": round((self.started or now) - self.created, 3),
+        }
+        if self.started is not None:
+            job["run_seconds"] = round((self.finished or now) - self.started, 3)
+        if self.result is not None:
+            job.update(self.result)
+        if self.error is not None:
+            job["error"] = self.error
+        return job
+
+
+class JobQueue:
+    # Runs long requests in the background on a fixed number of asyncio workers, highest priority
+    # first, so the request that submitted one returns at once. Jobs live in this process only;
+    # finished ones are dropped JOB_TTL_SECONDS after they finish.
+    def __init__(self, describe_error, workers=JOB_WORKERS, max_queue=JOB_MAX_QUEUE, ttl=JOB_TTL_SECONDS):
+        self.describe_error = describe_error  # Turns a job's exception into the "error" it reports
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ttl = ttl
+        self.jobs = {}
+        self.depth = 0
+        self.running = 0
+        self._queue = None
+        self._loop = None
+        self._workers = []
+        self._order = itertools.count()
+        self._finished = deque()  # (expires, job_id), in the order the jobs finished
+        self._average_run = 1.0  # Moving average of run times, for Retry-After when the queue is full
+
+    def submit(self, kind, session_id, run, priority="normal"):
+        self.purge()
+        if self.depth >= self.max_queue:
+            raise RateLimited(self._average_run * self.depth / self.workers,
+                              "Too many summaries are waiting to be prepared. Please try again shortly.")
+        self._start()
+        job = Job(kind, session_id, priority, run)
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait((PRIORITIES[priority], next(self._order), job))
+        self.depth += 1
+        return job
+
+    def get(self, job_id):
+        self.purge()
+        return self.jobs.get(job_id)
+
+    def purge(self):
+        now = time.monotonic()
+        while self._finished and self._finished[0][0] <= now:
+            self.jobs.pop(self._finished.popleft()[1], None)
+
+    def _start(self):
+        # Workers are started on first use, on the loop that serves requests
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            _, _, job = await self._queue.get()
+            self.depth -= 1
+            self.running += 1
+            job.started = time.monotonic()
+            metrics.JOB_WAIT.observe(job.started - job.created, kind=job.kind)
+            job.set_status("running")
+            try:
+                job.result = await job.run()
+                status = "done"
+            except Exception as exc:
+                job.error = self.describe_error(exc)
+                status = "failed"
+            finally:
+                self.running -= 1
+            job.finished = time.monotonic()
+            self._average_run = 0.8 * self._average_run + 0.2 * (job.finished - job.started)
+            self._finished.append((job.finished + self.ttl, job.job_id))
+            metrics.JOBS.inc(kind=job.kind, status=status)
+            job.set_status(status)
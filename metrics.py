@@ -0,0 +1,242 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function  # Reads the value at scrape time instead of storing it
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, (), self.function()
+            return
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, key, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labelnames, key)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}")
+        return "\n".join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "socrateach_request_duration_seconds", "Time spent handling HTTP requests, by route.", ["method", "route"]))
+REQUESTS = REGISTRY.register(Counter(
+    "socrateach_requests_total", "HTTP requests handled, by route and status code.", ["method", "route", "status"]))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    "socrateach_request_errors_total", "HTTP requests that failed with a server error, by route.", ["method", "route"]))
+MODEL_LATENCY = REGISTRY.register(Histogram(
+    "socrateach_model_call_duration_seconds", "Time spent waiting on the upstream model, by call type.", ["call"]))
+MODEL_ERRORS = REGISTRY.register(Counter(
+    "socrateach_model_errors_total", "Upstream model calls that raised an error, by call type.", ["call"]))
+PROMPT_TOKENS = REGISTRY.register(Counter(
+    "socrateach_prompt_tokens_total", "Prompt tokens reported by the model, by call type.", ["call"]))
+RESPONSE_TOKENS = REGISTRY.register(Counter(
+    "socrateach_response_tokens_total", "Response tokens reported by the model, by call type.", ["call"]))
+HISTORY_TOKENS_SAVED = REGISTRY.register(Counter(
+    "socrateach_history_tokens_saved_total", "Estimated history tokens not resent thanks to summarization."))
+
+SINGLEFLIGHT_CALLS = REGISTRY.register(Counter(
+    "socrateach_singleflight_calls_total", "Upstream calls made on behalf of coalesced requests.", ["name"]))
+SINGLEFLIGHT_DEDUPLICATED = REGISTRY.register(Counter(
+    "socrateach_singleflight_deduplicated_total", "Requests that shared an identical in-flight call.", ["name"]))
+
+SCHEDULER_WAIT = REGISTRY.register(Histogram(
+    "socrateach_scheduler_wait_seconds", "Time model calls spent queued for their API key's quota."))
+SCHEDULER_REJECTIONS = REGISTRY.register(Counter(
+    "socrateach_scheduler_rejections_total", "Requests turned away with 429 because the queue was full."))
+UPSTREAM_RETRIES = REGISTRY.register(Counter(
+    "socrateach_upstream_rate_limit_retries_total", "Upstream rate-limit errors retried with backoff."))
+UPSTREAM_RATE_LIMITED = REGISTRY.register(Counter(
+    "socrateach_upstream_rate_limited_total", "Requests that still hit the upstream rate limit after retrying."))
+
+MODEL_TIER_LATENCY = REGISTRY.register(Histogram(
+    "socrateach_model_tier_duration_seconds", "Time spent waiting on the upstream model, by model tier.", ["tier"]))
+MODEL_ROUTED = REGISTRY.register(Counter(
+    "socrateach_model_routed_total", "Model calls routed to each tier, by assistant method.", ["method", "tier"]))
+MODEL_TIER_FALLBACKS = REGISTRY.register(Counter(
+    "socrateach_model_tier_fallbacks_total", "Calls retried on the larger model after the routed tier failed.", ["tier"]))
+
+HEDGED_REQUESTS = REGISTRY.register(Counter(
+    "socrateach_hedged_requests_total", "Side calls that were slow enough to send a second, hedging request.", ["call"]))
+HEDGE_WINS = REGISTRY.register(Counter(
+    "socrateach_hedge_wins_total", "Hedged side calls answered first by the second request.", ["call"]))
+HEDGES_SKIPPED = REGISTRY.register(Counter(
+    "socrateach_hedges_skipped_total", "Slow side calls not hedged because their API key had no quota to spare.", ["call"]))
+
+WEBSOCKET_RESUMES = REGISTRY.register(Counter(
+    "socrateach_websocket_resumes_total", "Conversations resumed on a new /ws/session connection, by whether every missed message was replayed.", ["complete"]))
+
+JOBS = REGISTRY.register(Counter(
+    "socrateach_jobs_total", "Background jobs finished, by kind and final status.", ["kind", "status"]))
+JOB_WAIT = REGISTRY.register(Histogram(
+    "socrateach_job_wait_seconds", "Time background jobs spent queued before a worker picked them up, by kind.", ["kind"]))
+
+CASSETTE_REPLAYS = REGISTRY.register(Counter(
+    "socrateach_cassette_replays_total", "Model calls answered from a recorded cassette, by whether the prompt was recorded.", ["result"]))
+
+
+def record_usage(call, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    PROMPT_TOKENS.inc(usage.prompt_token_count or 0, call=call)
+    RESPONSE_TOKENS.inc(usage.candidates_token_count or 0, call=call)
+
+
+@contextmanager
+def model_call(call):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        MODEL_ERRORS.inc(call=call)
+        raise
+    finally:
+        MODEL_LATENCY.observe(time.perf_counter() - start, call=call)
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware so the per-request overhead stays at a couple of clock reads
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            route = route.path if route is not None else "unmatched"
+            method = scope["method"]
+            REQUEST_LATENCY.observe(time.perf_counter() - start, method=method, route=route)
+            REQUESTS.inc(method=method, route=route, status=status)
+            if status >= 500:
+                REQUEST_ERRORS.inc(method=method, route=route)
@@ -0,0 +1,72 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from deadlines import CallScope
+
+# Upper bound on Gemini calls running at once; anything beyond this waits for a free worker
+MODEL_WORKERS = int(os.environ.get("SOCRATEACH_MODEL_WORKERS", "32"))
+
+executor = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="socrateach-model")
+
+
+async def run_model_call(func, *args, **kwargs):
+    # The SDK calls block on network I/O, so run them off the event loop, under the request deadline
+    scope = CallScope()
+    future = asyncio.wrap_future(executor.submit(functools.partial(scope.run, func, *args, **kwargs)))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # The caller went away. The thread can't be interrupted, but it starts no further upstream
+        # calls; wait for it so the session isn't handed to the next request mid-turn.
+        scope.cancel()
+        await asyncio.wait([future])
+        raise
+
+
+async def stream_model_call(func, *args, **kwargs):
+    # Iterates a blocking generator on the pool and hands its items back to the event loop
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def publish(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError:  # Event loop already closed
+            stopped.set()
+
+    scope = CallScope()
+
+    def produce():
+        iterator = scope.iterate(func, *args, **kwargs)
+        try:
+            for item in iterator:
+                if stopped.is_set():
+                    break
+                publish(item)
+        except Exception as exc:
+            publish(done, exc)
+        else:
+            publish(done)
+        finally:
+            iterator.close()
+
+    future = loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Stop the producer when the consumer goes away, e.g. on client disconnect, and wait for it:
+        # closing the generator still touches the chat session, which the caller is about to release
+        stopped.set()
+        scope.cancel()
+        await asyncio.wait([future])
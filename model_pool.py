@@ -0,0 +1,71 @@
+import os
+import threading
+from collections import OrderedDict
+
+MODEL_POOL_SIZE = int(os.environ.get("SOCRATEACH_MODEL_POOL_SIZE", "256"))
+
+
+def load_sdk():
+    # google.generativeai pulls in grpc and protobuf and dominates cold start, so it is only
+    # imported when the first model is built (or by the prewarm hook)
+    import google.generativeai as genai
+    from google.generativeai import client as genai_client
+
+    return genai, genai_client
+
+
+class ModelPool:
+    # Keeps configured GenerativeModel instances warm, keyed by API key, generation settings and system instruction.
+    # Each API key gets its own transport client, so nothing touches the SDK's global genai.configure state.
+    def __init__(self, max_size=MODEL_POOL_SIZE):
+        self.max_size = max_size
+        self._models = OrderedDict()
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key, model_name, generation_config, system_instruction=None):
+        key = (api_key, model_name, tuple(sorted(generation_config.items())), system_instruction)
+        with self._lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+
+        genai, _ = load_sdk()
+        model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            system_instruction=system_instruction,
+        )
+        model._client = self._client_for(api_key)
+        with self._lock:
+            # Another thread may have built the same model meanwhile; keep the first one
+            model = self._models.setdefault(key, model)
+            self._models.move_to_end(key)
+            self._trim(self._models)
+        return model
+
+    def _client_for(self, api_key):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is not None:
+                self._clients.move_to_end(api_key)
+                return client
+
+        _, genai_client = load_sdk()
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        client = manager.make_client("generative")
+        with self._lock:
+            client = self._clients.setdefault(api_key, client)
+            self._clients.move_to_end(api_key)
+            self._trim(self._clients)
+        return client
+
+    def _trim(self, entries):
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._models)
@@ -0,0 +1,67 @@
+import os
+import re
+
+from deadlines import CallCancelled, DeadlineExceeded
+from scheduler import RateLimited
+
+FAST = "fast"
+STRONG = "strong"
+
+MODEL_TIERS = {
+    FAST: os.environ.get("SOCRATEACH_FAST_MODEL", "gemini-1.5-flash"),
+    STRONG: os.environ.get("SOCRATEACH_STRONG_MODEL", "gemini-1.5-pro"),
+}
+
+# "tiered" picks a model per call; "fast" or "strong" sends every call to that one model
+MODEL_ROUTING = os.environ.get("SOCRATEACH_MODEL_ROUTING", "tiered")
+if MODEL_ROUTING != "tiered" and MODEL_ROUTING not in MODEL_TIERS:
+    raise ValueError(f"Unknown model routing: {MODEL_ROUTING}")
+
+# Acknowledging a settings change or condensing the history never needs the larger model,
+# while the summaries assess the student and are worth its quality
+FAST_METHODS = {"change_difficulty", "switch_mode", "summary"}
+STRONG_METHODS = {"check_understanding", "conclude_topic", "precompute"}
+
+REASONING_WORDS = re.compile(
+    r"\b(why|prove|proof|complexity|big[- ]?o|invariant|recurrence|amortized|compare|trade-?offs?|"
+    r"worst[- ]case|edge cases?|optimi[sz]e|confused|confusing|don't understand|do not understand|lost)\b",
+    re.IGNORECASE,
+)
+CODE_MARKERS = re.compile(r"```|\bdef |\breturn\b|\bfor\s*\(|\bwhile\s*\(|[{};]\s*$|\w\[[^\]]*\]\s*=", re.MULTILINE)
+
+
+def needs_strong_model(user_input):
+    # Cheap local classifier: long answers, code, reasoning questions and confusion need the larger model
+    if not user_input:
+        return False
+    return (len(user_input.split()) > 60 or user_input.count("?") > 1
+            or REASONING_WORDS.search(user_input) is not None or CODE_MARKERS.search(user_input) is not None)
+
+
+def choose_tier(method, difficulty, user_input=None):
+    if MODEL_ROUTING != "tiered":
+        return MODEL_ROUTING
+    if method in FAST_METHODS:
+        return FAST
+    if method in STRONG_METHODS or difficulty == "hard":
+        return STRONG
+    if needs_strong_model(user_input):
+        return STRONG
+    return FAST
+
+
+# Upstream status codes that the other model would get too: a bad request, key or permission
+PERMANENT_ERROR_CODES = {400, 401, 403}
+
+
+def fallback(tier):
+    # Where a failed call is retried; the larger model has nothing to fall back to
+    return STRONG if tier == FAST else None
+
+
+def should_fall_back(exc):
+    # Only failures the larger model might not share. Rate limits were already retried with backoff,
+    # the deadline and a cancelled request cover every call, and a rejected key is rejected by both.
+    if isinstance(exc, (RateLimited, DeadlineExceeded, CallCancelled)):
+        return False
+    return getattr(exc, "code", None) not in PERMANENT_ERROR_CODES
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+OPENER_CACHE_PATH = os.environ.get("SOCRATEACH_OPENER_CACHE_PATH", "opener_cache.sqlite3")
+OPENER_CACHE_TTL = float(os.environ.get("SOCRATEACH_OPENER_CACHE_TTL", "86400"))
+OPENER_CACHE_VARIANTS = int(os.environ.get("SOCRATEACH_OPENER_CACHE_VARIANTS", "3"))
+
+
+class OpenerCache:
+    # Disk-backed store of model replies to the opening prompt of a conversation.
+    # Up to `variants` replies are collected per prompt before they start being served, so
+    # students starting the same topic don't all get an identical first message.
+    def __init__(self, path=OPENER_CACHE_PATH, ttl=OPENER_CACHE_TTL, variants=OPENER_CACHE_VARIANTS):
+        self.ttl = ttl
+        self.variants = variants
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if variants > 0:
+            self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS openers (cache_key TEXT NOT NULL, response TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS openers_cache_key ON openers (cache_key)")
+            self._conn.commit()
+
+    @property
+    def enabled(self):
+        return self._conn is not None
+
+    def key(self, model_name, generation_config, prompt):
+        # Whitespace differences don't change the reply, so they don't change the key either
+        normalized = [" ".join(part.split()) if isinstance(part, str) else part for part in prompt]
+        payload = json.dumps([model_name, generation_config, normalized], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT response FROM openers WHERE cache_key = ? AND created_at >= ?",
+                (cache_key, time.time() - self.ttl),
+            ).fetchall()
+            if len(rows) < self.variants:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return random.choice(rows)[0]
+
+    def put(self, cache_key, response):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("DELETE FROM openers WHERE cache_key = ? AND created_at < ?", (cache_key, now - self.ttl))
+            self._conn.execute(
+                "INSERT INTO openers (cache_key, response, created_at) VALUES (?, ?, ?)", (cache_key, response, now)
+            )
+            self._conn.commit()
@@ -0,0 +1,129 @@
+import functools
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+MODES = ["Socratic", "Q&A"]
+
+DIFFICULTY_GUIDANCE = {
+    "easy": "Use simpler terms and focus on basic concepts.",
+    "medium": "Introduce more complex ideas and terminology.",
+    "hard": "Challenge the student with advanced concepts, edge cases, and deeper analysis.",
+}
+
+MODE_GUIDANCE = {
+    "Socratic": """
+    For each student response, analyze their understanding and formulate a Socratic question to deepen their knowledge
+    of {topic}. Guide them towards understanding rather than providing direct answers.
+    If they seem confused, break down the concept further.
+    If they show understanding, challenge them with a more advanced aspect of {topic}.
+    """,
+    "Q&A": """
+    For each student question, provide a clear, concise, and direct answer about {topic}.
+    If the question asks for code, include a relevant code snippet.
+    Do not use the Socratic method or ask the student to think about the process themselves.
+    If the question is not directly related to {topic}, provide a brief answer
+    and gently redirect to the current topic.
+    """,
+}
+
+SYSTEM_INSTRUCTION = """
+You are a teaching assistant specializing in Data Structures and Algorithms,
+particularly in {topic}. Your goal is to help the student understand {topic}.
+Focus on concepts like: {concepts}.
+The current difficulty level is {difficulty}: {difficulty_guidance}
+The current mode is {mode}.
+{mode_guidance}
+Student messages arrive prefixed with a tag such as [mode=Socratic difficulty=medium] that states the current settings.
+Some messages include reference notes from the course material; ground your reply in them and keep it focused.
+"""
+
+
+# The static teaching rules live in the model's system instruction, built once per
+# (topic, difficulty, mode), so the chat history only carries the per-turn messages below.
+# Bounded anyway, though topics, difficulties and modes are all checked before a conversation starts.
+@functools.lru_cache(maxsize=256)
+def system_instruction(topic, concepts, difficulty, mode):
+    return SYSTEM_INSTRUCTION.format(
+        topic=topic,
+        concepts=", ".join(concepts),
+        difficulty=difficulty,
+        difficulty_guidance=DIFFICULTY_GUIDANCE.get(difficulty, DIFFICULTY_GUIDANCE["medium"]),
+        mode=mode,
+        mode_guidance=MODE_GUIDANCE.get(mode, MODE_GUIDANCE["Socratic"]).format(topic=topic),
+    )
+
+
+def state_tag(difficulty, mode):
+    return f"[mode={mode} difficulty={difficulty}]"
+
+
+def opening_message(topic, difficulty, mode):
+    return f"{state_tag(difficulty, mode)} Start the lesson by asking what the student already knows about {topic}."
+
+
+def turn_message(user_input, difficulty, mode, references=()):
+    label = "response" if mode == "Socratic" else "question"
+    message = f'{state_tag(difficulty, mode)} The student\'s {label}: "{user_input}"'
+    if references:
+        notes = "\n".join(f"- {reference}" for reference in references)
+        message += f"\nReference notes:\n{notes}"
+    return message
+
+
+def difficulty_change_message(difficulty, mode):
+    return (
+        f"{state_tag(difficulty, mode)} The difficulty level has been changed to {difficulty}. "
+        "Inform the student about the change and ask an appropriate question to continue the lesson at the new level."
+    )
+
+
+def mode_change_message(difficulty, mode):
+    return (
+        f"{state_tag(difficulty, mode)} The conversation mode has been switched to {mode} mode. "
+        "Acknowledge the mode change and set the tone for the new mode."
+    )
+
+
+def idle_nudge(topic, mode):
+    # Pushed to a WebSocket client when the student has gone quiet; it never enters the chat history
+    if mode == "Q&A":
+        return f"Is there anything else about {topic} you'd like to ask?"
+    return f"Still thinking it over? Tell me what you have so far about {topic}, even if it's only a hunch."
+
+
+def unknown_topic_message(topic, covered_by, topics):
+    if covered_by is not None:
+        return f"I'm sorry, I don't have a lesson on {topic} by itself. It's covered in the {covered_by} lesson; choose {covered_by} to start it."
+    choices = " or ".join(topics) if len(topics) <= 2 else f"{', '.join(topics[:-1])}, or {topics[-1]}"
+    return f"I'm sorry, I don't have information about {topic}. Let's discuss {choices}."
+
+
+def related_topics_note(suggestions):
+    # Appended to the summaries from the local topic graph instead of asking the model for suggestions
+    if not suggestions:
+        return ""
+    lines = "\n".join(f"- {suggestion['topic']} ({suggestion['difficulty']}): {suggestion['reason']}" for suggestion in suggestions)
+    return f"\n\nRelated topics to explore next:\n{lines}"
+
+
+def check_understanding_message(topic):
+    return f"""
+    Based on the conversation so far about {topic}, provide the following:
+    1. A brief summary (2-3 sentences) of what we've discussed and the main concepts covered.
+    2. An assessment of the student's current understanding, noting any areas of strength or confusion.
+    3. A question or set of options for the student to choose from, such as:
+    a) Would you like to dive deeper into any specific aspect of {topic}?
+    b) Are you ready to move on to a related topic? Don't name any; a list of them follows your reply.
+    c) Do you feel you've grasped the main concepts and want to conclude this topic?
+    d) Are there any parts of {topic} you'd like me to explain differently?
+
+    Present this information clearly and concisely, maintaining a supportive and encouraging tone.
+    """
+
+
+def conclude_topic_message(topic):
+    return f"""
+    Provide a concise summary of the key points discussed about {topic}.
+    Highlight the main concepts learned, any problem-solving strategies introduced, and how to practise them.
+    Don't suggest other topics to study next; a list of them follows your summary.
+    End with an encouraging message about applying this knowledge to real-world programming challenges.
+    """
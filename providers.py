@@ -0,0 +1,178 @@
+import hashlib
+import os
+import random
+import time
+
+from history import content_text, estimate_tokens
+from model_pool import ModelPool, load_sdk
+
+# "gemini" talks to Google's API; "stub" answers locally with canned text for load tests and offline work;
+# "record" and "replay" capture real calls to a cassette and play them back (see cassette.py)
+LLM_PROVIDER = os.environ.get("SOCRATEACH_LLM_PROVIDER", "gemini")
+STUB_LATENCY = float(os.environ.get("SOCRATEACH_STUB_LATENCY", "0.05"))
+STUB_TOKENS_PER_SECOND = float(os.environ.get("SOCRATEACH_STUB_TOKENS_PER_SECOND", "400"))
+STUB_REPLY_TOKENS = int(os.environ.get("SOCRATEACH_STUB_REPLY_TOKENS", "120"))
+# Fraction of stub calls whose time to first token is STUB_STRAGGLER_FACTOR times longer, to exercise tail latency
+STUB_STRAGGLER_RATE = float(os.environ.get("SOCRATEACH_STUB_STRAGGLER_RATE", "0"))
+STUB_STRAGGLER_FACTOR = 20
+
+
+class LLMProvider:
+    # Hands out model objects with the google.generativeai surface the assistant relies on:
+    # model.start_chat(history=...), model.generate_content(prompt), and a chat session with
+    # send_message(prompt, stream=...), history, rewind() and a rebindable `model` attribute.
+    name = None
+
+    def get_model(self, api_key, model_name, generation_config, system_instruction=None):
+        raise NotImplementedError
+
+    def prewarm(self):
+        # Optional: do expensive one-time setup ahead of the first request
+        pass
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, pool=None):
+        self.pool = pool if pool is not None else ModelPool()
+
+    def get_model(self, api_key, model_name, generation_config, system_instruction=None):
+        return self.pool.get(api_key, model_name, generation_config, system_instruction)
+
+    def prewarm(self):
+        load_sdk()
+
+
+STUB_SENTENCES = [
+    "What do you already know about how this algorithm handles its input?",
+    "Think about what happens to the largest element after the first pass.",
+    "How would the running time change if the input were already sorted?",
+    "Can you describe the invariant that holds after each iteration?",
+    "Which data structure would make that lookup faster, and why?",
+    "Let's walk through a small example with five elements together.",
+]
+
+
+class StubUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class StubChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubResponse:
+    # Sleeps for the configured time to first token, then "generates" at the configured token rate.
+    # Like the SDK, it gives up with an error once request_options' timeout has passed.
+    def __init__(self, provider, text, prompt_tokens, stream, on_complete=None, timeout=None):
+        self.provider = provider
+        self.text = text
+        self.usage_metadata = StubUsage(prompt_tokens, len(text.split()))
+        self._on_complete = on_complete
+        self.latency = provider.latency
+        if random.random() < provider.straggler_rate:
+            self.latency *= STUB_STRAGGLER_FACTOR
+        duration = self.latency if stream else self.latency + self.usage_metadata.candidates_token_count / provider.tokens_per_second
+        if timeout is not None and duration > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("Stub request timed out")
+        if not stream:
+            time.sleep(duration)
+            self._complete()
+
+    def __iter__(self):
+        words = self.text.split(" ")
+        time.sleep(self.latency)
+        for start in range(0, len(words), self.provider.chunk_tokens):
+            chunk = words[start:start + self.provider.chunk_tokens]
+            time.sleep(len(chunk) / self.provider.tokens_per_second)
+            yield StubChunk(" ".join(chunk) + (" " if start + len(chunk) < len(words) else ""))
+        self._complete()
+
+    def _complete(self):
+        if self._on_complete is not None:
+            self._on_complete(self)
+            self._on_complete = None
+
+
+class StubChatSession:
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = list(history or [])
+
+    def send_message(self, content, stream=False, **kwargs):
+        prompt = {"role": "user", "parts": [content]}
+
+        def record(response):
+            self.history.extend([prompt, {"role": "model", "parts": [response.text]}])
+
+        return self.model.respond(self.history + [prompt], stream, on_complete=record, **kwargs)
+
+    def rewind(self):
+        # Streamed turns are only recorded once complete, so an abandoned one left nothing behind
+        return None
+
+
+class StubModel:
+    def __init__(self, provider, model_name, system_instruction):
+        self.provider = provider
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def start_chat(self, history=None):
+        return StubChatSession(self, history)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        contents = contents if isinstance(contents, list) else [{"role": "user", "parts": [contents]}]
+        return self.respond(contents, stream, **kwargs)
+
+    def respond(self, contents, stream, on_complete=None, request_options=None):
+        prompt_tokens = sum(estimate_tokens(content_text(content)) for content in contents)
+        if self.system_instruction:
+            prompt_tokens += estimate_tokens(self.system_instruction)
+        text = self.provider.reply(content_text(contents[-1]))
+        timeout = (request_options or {}).get("timeout")
+        return StubResponse(self.provider, text, prompt_tokens, stream, on_complete, timeout)
+
+
+class StubProvider(LLMProvider):
+    # Deterministic local stand-in for Gemini: the same prompt always gets the same reply.
+    name = "stub"
+
+    def __init__(self, latency=STUB_LATENCY, tokens_per_second=STUB_TOKENS_PER_SECOND,
+                 reply_tokens=STUB_REPLY_TOKENS, chunk_tokens=8, straggler_rate=STUB_STRAGGLER_RATE):
+        self.latency = latency
+        self.straggler_rate = straggler_rate
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.chunk_tokens = chunk_tokens
+
+    def get_model(self, api_key, model_name, generation_config, system_instruction=None):
+        return StubModel(self, model_name, system_instruction)
+
+    def reply(self, prompt):
+        start = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16) % len(STUB_SENTENCES)
+        words = []
+        index = start
+        while len(words) < self.reply_tokens:
+            words.extend(STUB_SENTENCES[index % len(STUB_SENTENCES)].split())
+            index += 1
+        return " ".join(words[:self.reply_tokens])
+
+
+def create_provider(name=LLM_PROVIDER):
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "stub":
+        return StubProvider()
+    if name in ("record", "replay"):
+        import cassette
+
+        if name == "record":
+            return cassette.RecordingProvider(create_provider(cassette.RECORD_PROVIDER))
+        return cassette.ReplayProvider()
+    raise ValueError(f"Unknown LLM provider: {name}")
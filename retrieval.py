@@ -0,0 +1,157 @@
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+
+import numpy as np
+
+KNOWLEDGE_DIR = os.environ.get("SOCRATEACH_KNOWLEDGE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge"))
+INDEX_DIR = os.environ.get("SOCRATEACH_INDEX_DIR", os.path.join(KNOWLEDGE_DIR, ".index"))
+RETRIEVAL_TOP_K = int(os.environ.get("SOCRATEACH_RETRIEVAL_TOP_K", "3"))
+CHUNK_WORDS = 120
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i if in is it its of on or so that the "
+    "their them then there these this to was what when which while who why will with you your".split()
+)
+
+
+def tokenize(text):
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+def topic_name(path):
+    return os.path.splitext(os.path.basename(path))[0].replace("_", " ")
+
+
+def chunk_note(topic, text):
+    # One chunk per paragraph group under each "## concept" heading, capped at CHUNK_WORDS words
+    chunks = []
+    concept = None
+    for section in re.split(r"^(?=#{1,2} )", text, flags=re.MULTILINE):
+        heading, _, body = section.partition("\n")
+        if heading.startswith("## "):
+            concept = heading[3:].strip().lower()
+        elif not heading.startswith("# "):
+            body = section
+        current = []
+        for paragraph in (p.strip() for p in body.split("\n\n")):
+            if not paragraph:
+                continue
+            if current and len(" ".join(current).split()) + len(paragraph.split()) > CHUNK_WORDS:
+                chunks.append({"topic": topic, "concept": concept, "text": " ".join(current)})
+                current = []
+            current.append(paragraph)
+        if current:
+            chunks.append({"topic": topic, "concept": concept, "text": " ".join(current)})
+    return chunks
+
+
+def note_paths(knowledge_dir):
+    if not os.path.isdir(knowledge_dir):
+        return []
+    return sorted(
+        os.path.join(knowledge_dir, name) for name in os.listdir(knowledge_dir) if name.endswith((".md", ".txt"))
+    )
+
+
+def fingerprint(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write_atomic(path, write):
+    # Other workers may have the old file memory-mapped; replacing it leaves their copy intact
+    handle = tempfile.NamedTemporaryFile(dir=os.path.dirname(path), prefix=".tmp-", delete=False)
+    try:
+        with handle:
+            write(handle)
+        os.replace(handle.name, path)
+    except BaseException:
+        os.unlink(handle.name)
+        raise
+
+
+class ContentIndex:
+    # BM25 index over the Markdown/text notes in KNOWLEDGE_DIR, one file per topic, with "##" headings
+    # naming the concepts. The term weights are precomputed into a (terms x chunks) matrix saved as .npy
+    # and memory-mapped on load, so startup only reads the small metadata file.
+    def __init__(self, meta, weights):
+        self.topics = meta["topics"]
+        self.chunks = meta["chunks"]
+        self.vocabulary = {term: index for index, term in enumerate(meta["vocabulary"])}
+        self.weights = weights
+        self._topic_of_chunk = np.array([chunk["topic"] for chunk in self.chunks], dtype=object)
+
+    @classmethod
+    def load(cls, knowledge_dir=KNOWLEDGE_DIR, index_dir=INDEX_DIR):
+        paths = note_paths(knowledge_dir)
+        if not paths:
+            return None
+        meta_path = os.path.join(index_dir, "meta.json")
+        weights_path = os.path.join(index_dir, "weights.npy")
+        current = fingerprint(paths)
+        try:
+            with open(meta_path, encoding="utf-8") as handle:
+                meta = json.load(handle)
+            if meta["fingerprint"] == current:
+                return cls(meta, np.load(weights_path, mmap_mode="r"))
+        except (OSError, ValueError, KeyError):
+            pass
+        meta, weights = cls.build(paths, current)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            # Weights before metadata, so a metadata file that matches always has its weights beside it
+            write_atomic(weights_path, lambda handle: np.save(handle, weights))
+            write_atomic(meta_path, lambda handle: handle.write(json.dumps(meta).encode("utf-8")))
+        except OSError:
+            return cls(meta, weights)  # Read-only index dir: serve this process from memory
+        return cls(meta, np.load(weights_path, mmap_mode="r"))
+
+    @staticmethod
+    def build(paths, current_fingerprint):
+        topics = {}
+        chunks = []
+        for path in paths:
+            topic = topic_name(path)
+            with open(path, encoding="utf-8") as handle:
+                note_chunks = chunk_note(topic, handle.read())
+            topics[topic] = list(dict.fromkeys(chunk["concept"] for chunk in note_chunks if chunk["concept"]))
+            chunks.extend(note_chunks)
+
+        term_counts = [Counter(tokenize(f"{chunk['concept'] or ''} {chunk['text']}")) for chunk in chunks]
+        vocabulary = sorted(set().union(*term_counts)) if term_counts else []
+        term_index = {term: index for index, term in enumerate(vocabulary)}
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        average_length = float(lengths.mean()) if len(lengths) else 0.0
+
+        weights = np.zeros((len(vocabulary), len(chunks)), dtype=np.float32)
+        document_frequency = Counter(term for counts in term_counts for term in counts)
+        for column, counts in enumerate(term_counts):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[column] / average_length)
+            for term, count in counts.items():
+                df = document_frequency[term]
+                idf = math.log(1 + (len(chunks) - df + 0.5) / (df + 0.5))
+                weights[term_index[term], column] = idf * count * (BM25_K1 + 1) / (count + norm)
+
+        meta = {"fingerprint": current_fingerprint, "topics": topics, "chunks": chunks, "vocabulary": vocabulary}
+        return meta, weights
+
+    def search(self, query, topic=None, k=RETRIEVAL_TOP_K):
+        rows = sorted({self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary})
+        if not rows or k <= 0:
+            return []
+        scores = np.asarray(self.weights[rows]).sum(axis=0)
+        if topic is not None:
+            scores = np.where(self._topic_of_chunk == topic, scores, 0.0)
+        best = np.argsort(-scores)[:k]
+        return [self.chunks[i] for i in best if scores[i] > 0]
@@ -0,0 +1,250 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import math
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+import deadlines
+import metrics
+from model_executor import MODEL_WORKERS
+
+# Local limits per API key, matched to its Gemini quota; 0 leaves that limit to the upstream
+KEY_RPM = float(os.environ.get("SOCRATEACH_KEY_RPM", "0"))
+KEY_TPM = float(os.environ.get("SOCRATEACH_KEY_TPM", "0"))
+MAX_INFLIGHT = int(os.environ.get("SOCRATEACH_SCHEDULER_MAX_INFLIGHT", str(MODEL_WORKERS)))
+MAX_QUEUE = int(os.environ.get("SOCRATEACH_SCHEDULER_MAX_QUEUE", "256"))
+MAX_WAIT_SECONDS = float(os.environ.get("SOCRATEACH_SCHEDULER_MAX_WAIT", "30"))
+RATE_LIMIT_RETRIES = int(os.environ.get("SOCRATEACH_RATE_LIMIT_RETRIES", "3"))
+RATE_LIMIT_BACKOFF = float(os.environ.get("SOCRATEACH_RATE_LIMIT_BACKOFF", "1.0"))
+RATE_LIMIT_BACKOFF_MAX = 30.0
+REPLY_TOKEN_ESTIMATE = 256  # Charged up front for the reply, whose real size isn't known yet
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, detail="The model is busy. Please try again shortly."):
+        super().__init__(detail)
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def key_label(api_key):
+    # API keys never appear in metrics or logs, only a short digest of them
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+def is_rate_limit_error(exc):
+    # google.api_core's ResourceExhausted carries code 429; checked by value so the SDK isn't imported here
+    return getattr(exc, "code", None) == 429 or type(exc).__name__ == "ResourceExhausted"
+
+
+def backoff_delay(attempt):
+    # Full jitter, so clients that were throttled together don't retry together
+    return random.uniform(0, min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF * 2 ** attempt))
+
+
+def call_with_backoff(func, *args, **kwargs):
+    # Runs on a model worker thread. Retries upstream 429s, then gives up with RateLimited.
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as exc:
+            if not is_rate_limit_error(exc):
+                raise
+            metrics.UPSTREAM_RETRIES.inc()
+            if attempt == RATE_LIMIT_RETRIES:
+                raise RateLimited(min(RATE_LIMIT_BACKOFF_MAX, RATE_LIMIT_BACKOFF * 2 ** (attempt + 1))) from exc
+            deadlines.sleep(backoff_delay(attempt))
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def take(self, amount, now):
+        if self.capacity > 0:
+            self._refill(now)
+            self.tokens -= amount
+
+
+class KeyState:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.waiters = deque()
+        self.blocked_until = 0.0  # Set when the upstream keeps rejecting this key
+
+    def wait_time(self, tokens, now, requests=1):
+        return max(self.blocked_until - now, self.requests.wait_time(requests, now), self.tokens.wait_time(tokens, now))
+
+    def backlog_wait(self, tokens, now):
+        # How long a new request would wait behind everything this key already has queued
+        queued_tokens = sum(entry[1] for entry in self.waiters)
+        return self.wait_time(queued_tokens + tokens, now, len(self.waiters) + 1)
+
+    def take(self, tokens, now):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+
+class Scheduler:
+    # Admits model calls in round-robin order across API keys, within each key's RPM/TPM budget and
+    # a global cap on calls in flight. Requests of one key are served first come, first served; turns
+    # of one session are already serialized by its lock, so that is also fair across sessions.
+    # Runs entirely on the event loop.
+    def __init__(self, rpm=KEY_RPM, tpm=KEY_TPM, max_inflight=MAX_INFLIGHT, max_queue=MAX_QUEUE, max_wait=MAX_WAIT_SECONDS):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.inflight = 0
+        self.depth = 0
+        self._keys = {}
+        self._queued = OrderedDict()  # Keys with waiters, next in turn first
+        self._timer = None
+        self._timer_at = None
+
+    @asynccontextmanager
+    async def slot(self, api_key, tokens=0):
+        key = key_label(api_key)
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = KeyState(self.rpm, self.tpm)
+        tokens += REPLY_TOKEN_ESTIMATE
+        if self.tpm > 0:
+            tokens = min(tokens, self.tpm)  # A request larger than the bucket waits for a full one
+        start = time.monotonic()
+        wait = state.backlog_wait(tokens, start)
+        if self.depth >= self.max_queue or wait > self.max_wait:
+            # Students bring their own keys, so the key goes to the log rather than a metric label
+            metrics.SCHEDULER_REJECTIONS.inc()
+            logger.warning("Rejected a model call for key %s: queue depth %d, quota wait %.1fs", key, self.depth, wait)
+            raise RateLimited(max(wait, 1.0), "Too many requests are waiting for the model. Please try again shortly.")
+
+        entry = (asyncio.get_running_loop().create_future(), tokens)
+        state.waiters.append(entry)
+        self._queued.setdefault(key, None)
+        self.depth += 1
+        self._dispatch()
+        try:
+            await entry[0]
+        except BaseException:
+            if entry[0].done() and not entry[0].cancelled():
+                self._release()  # Granted just as the caller went away
+            elif entry in state.waiters:
+                state.waiters.remove(entry)
+                self.depth -= 1
+                if not state.waiters:
+                    self._queued.pop(key, None)
+            raise
+        metrics.SCHEDULER_WAIT.observe(time.monotonic() - start)
+
+        previous = deadlines.extra_call_quota.get()
+        deadlines.extra_call_quota.set(self._extra_call_quota(state, tokens))
+        try:
+            yield
+        except RateLimited as exc:
+            # Hold this key's queue back until the upstream is likely to accept it again
+            state.blocked_until = max(state.blocked_until, time.monotonic() + exc.retry_after)
+            metrics.UPSTREAM_RATE_LIMITED.inc()
+            logger.warning("Key %s is still rate limited upstream after retrying", key)
+            raise
+        finally:
+            deadlines.extra_call_quota.set(previous)
+            self._release()
+
+    def _extra_call_quota(self, state, tokens):
+        # Lets a worker thread charge an extra call, such as a hedging request, to this key's
+        # budget. Only granted when the key has nothing queued and room left in both buckets.
+        loop = asyncio.get_running_loop()
+
+        def charge():
+            now = time.monotonic()
+            if state.waiters or state.wait_time(tokens, now) > 0:
+                return False
+            state.take(tokens, now)
+            return True
+
+        def charge_from_thread():
+            future = concurrent.futures.Future()
+            try:
+                loop.call_soon_threadsafe(lambda: future.set_result(charge()))
+            except RuntimeError:  # Event loop already closed
+                return False
+            return future.result()
+
+        return charge_from_thread
+
+    def _release(self):
+        self.inflight -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        next_wake = None
+        progressed = True
+        while progressed and self._queued and self.inflight < self.max_inflight:
+            progressed = False
+            # One grant per key per pass; a key that was served moves to the back of the line
+            for key in list(self._queued):
+                if self.inflight >= self.max_inflight:
+                    break
+                state = self._keys[key]
+                waiter, tokens = state.waiters[0]
+                if waiter.done():  # Cancelled, its caller hasn't cleaned up yet
+                    state.waiters.popleft()
+                    self.depth -= 1
+                    if not state.waiters:
+                        del self._queued[key]
+                    progressed = True
+                    continue
+                wait = state.wait_time(tokens, now)
+                if wait > 0:
+                    next_wake = wait if next_wake is None else min(next_wake, wait)
+                    continue
+                state.waiters.popleft()
+                self.depth -= 1
+                state.take(tokens, now)
+                self.inflight += 1
+                waiter.set_result(None)
+                progressed = True
+                self._queued.move_to_end(key)
+                if not state.waiters:
+                    del self._queued[key]
+        if next_wake is not None:
+            self._wake_in(next_wake, now)
+
+    def _wake_in(self, delay, now):
+        if self._timer is not None:
+            if self._timer_at <= now + delay:
+                return
+            self._timer.cancel()
+        self._timer_at = now + delay
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
@@ -0,0 +1,54 @@
+import asyncio
+import os
+from collections import deque
+
+# The server pings every connection this often and drops it after two intervals without a frame
+WS_HEARTBEAT_SECONDS = float(os.environ.get("SOCRATEACH_WS_HEARTBEAT", "20"))
+# Messages kept per conversation for clients that reconnect
+WS_RESUME_BUFFER = int(os.environ.get("SOCRATEACH_WS_RESUME_BUFFER", "512"))
+# Seconds of silence from the student before the tutor checks in; 0 turns it off
+WS_NUDGE_SECONDS = float(os.environ.get("SOCRATEACH_WS_NUDGE_AFTER", "180"))
+
+# Put on a connection's send queue to make it close
+REPLACED = object()  # Another connection resumed the conversation
+CLOSE = object()  # The conversation ended
+
+
+class Outbox:
+    # Everything the server sends about one conversation over /ws/session. Messages are numbered and
+    # the last few hundred are kept, so a client that reconnects gets all those after the last seq it saw.
+    def __init__(self, size=WS_RESUME_BUFFER):
+        self.seq = 0
+        self.sent = deque(maxlen=size)
+        self.queue = None  # Send queue of the connected socket, if any
+
+    def put(self, message):
+        self.seq += 1
+        message = dict(message, seq=self.seq)
+        self.sent.append(message)
+        if self.queue is not None:
+            self.queue.put_nowait(message)
+
+    def attach(self, last_seq=None):
+        # Returns the new connection's send queue, primed with what it missed, and whether nothing
+        # was lost: the buffer may have moved on, or the session may come from another worker
+        if self.queue is not None:
+            self.queue.put_nowait(REPLACED)
+        self.queue = asyncio.Queue()
+        if last_seq is None:
+            return self.queue, True
+        if last_seq > self.seq:
+            self.seq = last_seq  # Keep counting up from what the client already has
+            return self.queue, False
+        missed = [message for message in self.sent if message["seq"] > last_seq]
+        for message in missed:
+            self.queue.put_nowait(message)
+        return self.queue, last_seq == self.seq or missed[0]["seq"] == last_seq + 1
+
+    def detach(self, queue):
+        if self.queue is queue:
+            self.queue = None
+
+    def close(self):
+        if self.queue is not None:
+            self.queue.put_nowait(CLOSE)
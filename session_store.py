@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# "memory" keeps conversation state in this process; "sqlite:///path/to/sessions.db" shares it
+# between uvicorn workers and keeps it across restarts
+SESSION_STORE_URL = os.environ.get("SOCRATEACH_SESSION_STORE", "memory")
+
+
+class SessionStore:
+    # Stores serialized conversation state. Every save bumps the session's version so
+    # workers can tell when their in-memory copy has gone stale.
+    blocking = True  # Calls may wait on disk or other workers, so they are kept off the event loop
+
+    def version(self, session_id):
+        raise NotImplementedError
+
+    def load(self, session_id):
+        # Returns (version, state) or None
+        raise NotImplementedError
+
+    def save(self, session_id, state):
+        # Returns the new version
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def purge(self, max_idle_seconds):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    blocking = False
+
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # session_id -> (version, state, updated_at), least recently saved first
+        self._lock = threading.Lock()
+
+    def version(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return entry[0] if entry else None
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            return (entry[0], entry[1]) if entry else None
+
+    def save(self, session_id, state):
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            version = entry[0] + 1 if entry else 1
+            self._entries[session_id] = (version, state, time.time())
+            if self.max_entries is not None:
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return version
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+
+    def purge(self, max_idle_seconds):
+        cutoff = time.time() - max_idle_seconds
+        with self._lock:
+            expired = [session_id for session_id, entry in self._entries.items() if entry[2] < cutoff]
+            for session_id in expired:
+                del self._entries[session_id]
+            return len(expired)
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self._lock = threading.Lock()
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._conn.execute("SELECT version, state FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save(self, session_id, state):
+        payload = json.dumps(state)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO sessions (session_id, version, state, updated_at) VALUES (?, 1, ?, ?) "
+                    "ON CONFLICT(session_id) DO UPDATE SET "
+                    "version = version + 1, state = excluded.state, updated_at = excluded.updated_at",
+                    (session_id, payload, time.time()),
+                )
+                version = self._conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return version
+
+    def delete(self, session_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def purge(self, max_idle_seconds):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_idle_seconds,))
+        return cursor.rowcount
+
+
+def create_session_store(url=SESSION_STORE_URL, max_entries=None):
+    if url == "memory":
+        return MemorySessionStore(max_entries)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported session store: {url}")
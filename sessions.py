@@ -0,0 +1,143 @@
+import asyncio
+import functools
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from session_store import create_session_store
+
+MAX_SESSIONS = int(os.environ.get("SOCRATEACH_MAX_SESSIONS", "5000"))
+SESSION_TTL_SECONDS = float(os.environ.get("SOCRATEACH_SESSION_TTL", "3600"))
+STORE_PURGE_INTERVAL = 60  # Seconds between sweeps of idle sessions out of the store
+SWEEP_INTERVAL = 60  # Seconds between sweeps of expired sessions out of memory
+STORE_WORKERS = int(os.environ.get("SOCRATEACH_STORE_WORKERS", "4"))
+
+# Session store queries run here rather than on the event loop
+store_executor = ThreadPoolExecutor(max_workers=STORE_WORKERS, thread_name_prefix="socrateach-store")
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+class Session:
+    def __init__(self, session_id, assistant, version=0):
+        self.session_id = session_id
+        self.assistant = assistant
+        self.version = version  # Store version this assistant was last saved at or restored from
+        self.lock = asyncio.Lock()  # Serializes turns within one conversation
+        self.last_access = time.monotonic()
+        self.outbox = None  # Messages for /ws/session clients, created by the first connection
+
+
+class SessionManager:
+    # Keeps live assistants in an LRU cache in front of a SessionStore. The store holds the
+    # durable copy, so an evicted, restarted or other-worker session is rebuilt from it on demand.
+    def __init__(self, assistant_factory, store=None, max_sessions=MAX_SESSIONS, ttl=SESSION_TTL_SECONDS):
+        self.assistant_factory = assistant_factory
+        self.store = store if store is not None else create_session_store(max_entries=max_sessions)
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()  # Least recently used first
+        self._lock = threading.Lock()
+        self._last_purge = time.monotonic()
+
+    async def _store_call(self, func, *args):
+        if not self.store.blocking:
+            return func(*args)
+        return await asyncio.get_running_loop().run_in_executor(store_executor, functools.partial(func, *args))
+
+    async def create(self):
+        session_id = uuid.uuid4().hex
+        session = Session(session_id, self.assistant_factory())
+        now = time.monotonic()
+        with self._lock:
+            self._evict_expired(now)
+            self._insert(session)
+            purge = now - self._last_purge > STORE_PURGE_INTERVAL
+            if purge:
+                self._last_purge = now
+        if purge:
+            await self._store_call(self.store.purge, self.ttl)
+        return session
+
+    async def get(self, session_id):
+        stored_version = await self._store_call(self.store.version, session_id)
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            expired = session is not None and now - session.last_access > self.ttl
+            # A session saved earlier but missing from the store was ended by another worker
+            ended = session is not None and stored_version is None and session.version > 0
+            if expired or ended:
+                del self._sessions[session_id]
+            elif session is not None and (stored_version is None or session.version >= stored_version):
+                session.last_access = now
+                self._sessions.move_to_end(session_id)
+                return session
+        if expired:
+            await self._store_call(self.store.delete, session_id)
+            raise SessionNotFound(session_id)
+        # Not held here, or another worker has saved a newer version since
+        return await self._restore(session_id)
+
+    async def _restore(self, session_id):
+        loaded = await self._store_call(self.store.load, session_id)
+        if loaded is None:
+            raise SessionNotFound(session_id)
+        version, state = loaded
+        with self._lock:
+            # Another request for this session may have restored it while this one waited on the store
+            session = self._sessions.get(session_id)
+            if session is not None and session.version >= version:
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return session
+        assistant = self.assistant_factory()
+        assistant.restore_state(state)
+        session = Session(session_id, assistant, version)
+        with self._lock:
+            self._insert(session)
+        return session
+
+    async def save(self, session):
+        session.version = await self._store_call(self.store.save, session.session_id, session.assistant.to_state())
+
+    async def remove(self, session_id):
+        await self._store_call(self.store.delete, session_id)
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def evict_expired(self):
+        with self._lock:
+            return self._evict_expired(time.monotonic())
+
+    async def sweep(self, interval=SWEEP_INTERVAL):
+        # Runs for the life of the app, so idle conversations don't hold their assistants until the next request
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_expired()
+
+    def _insert(self, session):
+        self._sessions[session.session_id] = session
+        self._sessions.move_to_end(session.session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _evict_expired(self, now):
+        # Sessions are kept in access order, so expired ones are all at the front.
+        evicted = 0
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_access <= self.ttl:
+                break
+            self._sessions.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
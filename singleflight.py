@@ -0,0 +1,45 @@
+import threading
+from concurrent.futures import Future
+
+import metrics
+
+
+FAILED = object()
+
+
+class SingleFlight:
+    # Coalesces identical concurrent calls: the first caller for a key runs the function and
+    # everyone who asks for the same key while it is in flight waits for and shares its result.
+    # Only results are shared. The leader's failure may be its own (a bad API key, a client that
+    # went away), so if it fails each waiting caller makes the call itself.
+    def __init__(self, name):
+        self.name = name
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            result = future.result()
+            if result is not FAILED:
+                metrics.SINGLEFLIGHT_DEDUPLICATED.inc(name=self.name)
+                return result
+            metrics.SINGLEFLIGHT_CALLS.inc(name=self.name)
+            return func(*args, **kwargs)
+
+        metrics.SINGLEFLIGHT_CALLS.inc(name=self.name)
+        try:
+            result = func(*args, **kwargs)
+        except BaseException:
+            future.set_result(FAILED)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
@@ -0,0 +1,80 @@
+import json
+import os
+
+TOPIC_GRAPH_PATH = os.environ.get(
+    "SOCRATEACH_TOPIC_GRAPH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge", "topic_graph.json"))
+MAX_SUGGESTIONS = 3
+
+
+def normalize(name):
+    return " ".join(name.replace("_", " ").replace("-", " ").lower().split())
+
+
+class TopicGraph:
+    # The topics taught, their concepts, prerequisite and related edges and a difficulty for each,
+    # from a small JSON file. Everything a lookup returns is derived once at load time, so answers
+    # are dict reads and identical on every worker that loads the same file.
+    def __init__(self, topics, concepts):
+        self.topics = topics
+        self.concepts = concepts
+        self._check()
+        self._topic_of = {concept: name for name, topic in topics.items() for concept in topic["concepts"]}
+        self._related = {name: self._build_related(name) for name in topics}
+
+    @classmethod
+    def load(cls, path=TOPIC_GRAPH_PATH):
+        with open(path, encoding="utf-8") as handle:
+            graph = json.load(handle)
+        return cls(graph["topics"], graph["concepts"])
+
+    def _check(self):
+        for name, topic in self.topics.items():
+            for other in topic["prerequisites"] + topic["related"]:
+                if other not in self.topics:
+                    raise ValueError(f"Topic {name!r} refers to unknown topic {other!r}")
+            for concept in topic["concepts"]:
+                if concept not in self.concepts:
+                    raise ValueError(f"Topic {name!r} lists unknown concept {concept!r}")
+        for name, concept in self.concepts.items():
+            for other in concept["prerequisites"] + concept["related"]:
+                if other not in self.concepts:
+                    raise ValueError(f"Concept {name!r} refers to unknown concept {other!r}")
+
+    def _build_related(self, name):
+        topic = self.topics[name]
+        unlocks = [other for other, data in self.topics.items() if name in data["prerequisites"]]
+        # Related edges go both ways, whichever side of the file lists them
+        related = list(topic["related"])
+        related += [other for other, data in self.topics.items() if name in data["related"] and other not in related]
+
+        # Topics that build on this one come first, then neighbours, then prerequisites worth revisiting
+        suggestions = []
+        neighbours = [other for other in related if other not in topic["prerequisites"]]
+        for others, reason in ((unlocks, f"builds on {name}"), (neighbours, f"related to {name}"),
+                               (topic["prerequisites"], f"a foundation of {name}")):
+            for other in others:
+                if other not in (suggestion["topic"] for suggestion in suggestions):
+                    suggestions.append({"topic": other, "difficulty": self.topics[other]["difficulty"], "reason": reason})
+        return {
+            "topic": name,
+            "difficulty": topic["difficulty"],
+            "prerequisites": list(topic["prerequisites"]),
+            "related": related,
+            "unlocks": unlocks,
+            "concepts": [dict(self.concepts[concept], name=concept) for concept in topic["concepts"]],
+            "suggestions": suggestions[:MAX_SUGGESTIONS],
+        }
+
+    def knowledge_base(self):
+        return {name: list(topic["concepts"]) for name, topic in self.topics.items()}
+
+    def related(self, topic):
+        # Raises KeyError for a topic that isn't taught
+        return self._related[topic]
+
+    def suggestions(self, topic):
+        return self._related[topic]["suggestions"] if topic in self._related else []
+
+    def topic_of(self, concept):
+        # The topic that covers a concept, e.g. "Binary search" -> "searching"; None if no topic does
+        return self._topic_of.get(normalize(concept))